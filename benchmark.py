@@ -0,0 +1,147 @@
+from weibo import WeiboSpider
+from metrics import Metrics
+from fake_driver import FakeDriver
+from snapshots import SnapshotArchive
+from pathlib import Path
+import sqlite3, subprocess, tempfile, logging, argparse, json, time, os
+
+
+def make_fixtures(directory: str, question: str, pages: int=3, cards: int=10, comments: int=40):
+    # synthetic search and detail pages with the structure the selectors expect
+    archive = SnapshotArchive(directory)
+    mid = 4700000000000000
+    for page in range(1, pages + 1):
+        items = []
+        for card in range(cards):
+            mid += 1
+            uid = 1000000 + mid % 100000
+            bid = 'B%d' % mid
+            items.append(
+                '<div action-type="feed_list_item" mid="%d"><div class="card-wrap"><div class="card"><div class="card-feed">'
+                '<div class="avator"><a href="//weibo.com/%d?refer_flag=1001030103_">'
+                '<img src="https://tvax1.sinaimg.cn/crop/%d.jpg"></a></div>'
+                '<div class="content"><div class="info"><a class="name" nick-name="用户%d" href="//weibo.com/%d">用户%d</a></div>'
+                '<p class="txt" node-type="feed_list_content">%s 第%d页 第%d条</p>'
+                '<div class="from"><a href="https://weibo.com/%d/%s?refer_flag=1001030103_" target="_blank">22-03-05 12:%02d</a>'
+                ' <a rel="nofollow">iPhone客户端</a></div></div></div></div></div></div>'
+                % (mid, uid, uid, uid, uid, uid, question, page, card, uid, bid, card % 60))
+            comment_items = []
+            for index in range(comments):
+                cuid = 2000000 + index
+                comment_items.append(
+                    '<div class="vue-recycle-scroller__item-view"><div class="wbpro-scroller-item" data-index="%d">'
+                    '<a href="/u/%d"></a><img class="woo-avatar-img" src="https://tvax2.sinaimg.cn/%d.jpg">'
+                    '<div>评论者%d:%s 评论 %d<br>22-3-5 13:%02d</div></div></div>'
+                    % (index, cuid, cuid, cuid, question, index, index % 60))
+            detail = ('<html><body><div class="head-info_info"><a class="head-info_time_6sFQg" href="https://weibo.com/%d/%s">'
+                      '22-03-05 12:%02d</a></div><div class="detail_wbtext_4CRf9">%s 第%d页 第%d条</div>'
+                      '<div class="vue-recycle-scroller__item-wrapper">%s</div></body></html>'
+                      % (uid, bid, card % 60, question, page, card, ''.join(comment_items)))
+            archive.save_detail(str(mid), detail)
+        next_link = ''
+        if page < pages:
+            next_link = '<div class="m-page"><a class="next" href="https://s.weibo.com/weibo?q=%s&page=%d">下一页</a></div>' % (
+                question, page + 1)
+        archive.save_search(question, page, '<html><body><div id="pl_feedlist_index">%s</div>%s</body></html>' % (
+            ''.join(items), next_link))
+    return archive
+
+def count_rows(db_path: str, table: str):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT count(*) FROM %s;' % table).fetchone()[0]
+    finally:
+        conn.close()
+
+def current_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True,
+                               cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+def run(fixtures: str, question: str, latency: float, load_latency: float, comment_mode: str, batch_cards: bool,
+        lean: bool=False):
+    fixtures = str(Path(fixtures).resolve())
+    workdir = tempfile.mkdtemp(prefix='wb-bench-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        metrics = Metrics()
+        driver = FakeDriver(SnapshotArchive(fixtures), latency, load_latency)
+        start = time.perf_counter()
+        with WeiboSpider(None, 'bench.db', log_level=logging.WARNING, driver=driver, metrics=metrics,
+                         batch_cards=batch_cards, comment_mode=comment_mode, drain_interval=0.05, lean=lean) as spider:
+            spider.search(question)
+        wall = time.perf_counter() - start
+        snap = metrics.snapshot()
+        return {
+            'wall': wall, 'round_trips': snap['round_trips'],
+            'posts': snap['counters'].get('posts', 0), 'comments': snap['counters'].get('comments', 0),
+            'rows': { 'message': count_rows('bench.db', 'message'), 'comment': count_rows('bench.db', 'comment'),
+                      'user': count_rows('users.sqlite', 'user') },
+            'stages': { k: round(v['total'], 4) for k, v in snap['stages'].items() },
+        }
+    finally:
+        os.chdir(cwd)
+
+def compare(result: dict, previous: dict, threshold: float):
+    regressions = []
+    for key in ('wall', 'round_trips'):
+        if previous[key] > 0 and result[key] > previous[key] * (1 + threshold):
+            regressions.append("%s %.3f -> %.3f (+%.1f%%)" % (
+                key, previous[key], result[key], (result[key] / previous[key] - 1) * 100))
+    if result['rows'] != previous['rows']:
+        regressions.append("rows %s -> %s" % (previous['rows'], result['rows']))
+    return regressions
+
+def load_results(path: str):
+    if not Path(path).exists():
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [ json.loads(line) for line in f if line.strip() ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixtures', help="SnapshotArchive directory, e.g. recorded with WeiboSpider(snapshots=...)")
+    parser.add_argument('question', nargs='?', default="乌克兰")
+    parser.add_argument('--make-fixtures', action='store_true', help="write synthetic fixtures first")
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--cards', type=int, default=10)
+    parser.add_argument('--comments', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.002, help="seconds per webdriver round trip")
+    parser.add_argument('--load-latency', type=float, default=0.05, help="seconds per page load")
+    parser.add_argument('--comment-mode', choices=['observer', 'poll'], default='observer')
+    parser.add_argument('--no-batch-cards', action='store_true')
+    parser.add_argument('--lean', action='store_true', help="reuse one detail tab")
+    parser.add_argument('--results', default='bench_results.jsonl')
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown flagged as regression")
+    args = parser.parse_args()
+
+    if args.make_fixtures:
+        make_fixtures(args.fixtures, args.question, args.pages, args.cards, args.comments)
+
+    config = { 'fixtures': str(Path(args.fixtures).resolve()), 'question': args.question, 'latency': args.latency,
+               'load_latency': args.load_latency, 'comment_mode': args.comment_mode,
+               'batch_cards': not args.no_batch_cards, 'lean': args.lean }
+    result = run(args.fixtures, args.question, args.latency, args.load_latency, args.comment_mode,
+                 not args.no_batch_cards, args.lean)
+    result.update(commit=current_commit(), config=config, time=time.time())
+
+    previous = [ r for r in load_results(args.results) if r['config'] == config and r['commit'] != result['commit'] ]
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    print("[+] %s: %.3fs wall, %d round trips, %d posts, %d comments, rows %s" % (
+        result['commit'], result['wall'], result['round_trips'], result['posts'], result['comments'], result['rows']))
+    if previous:
+        regressions = compare(result, previous[-1], args.threshold)
+        for regression in regressions:
+            print("[-] REGRESSION against %s: %s" % (previous[-1]['commit'], regression))
+        if regressions:
+            raise SystemExit(1)
+        print("[+] no regression against %s" % previous[-1]['commit'])
@@ -0,0 +1,101 @@
+from urllib.request import urlopen
+from urllib.error import URLError
+import subprocess, shlex, time
+
+# resources a text crawl never needs, avatar urls are still read from the img src attributes
+blocked_urls = [
+    '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.bmp', '*.svg', '*.ico',
+    '*.mp4', '*.m3u8', '*.flv', '*.mov', '*.webm', '*.mp3', '*.m4a',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+]
+
+
+def block_resources(driver, urls: list=None):
+    # blocking applies to the tab the driver is attached to, every new tab has to be blocked again
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', { 'urls': urls if urls is not None else blocked_urls })
+    except Exception as e:
+        print("[-] block resources error: ", str(e))
+        return False
+    return True
+
+
+class MemoryWatchdog:
+    # footprint of the browser behind a debug port, with psutil the whole process tree,
+    # without it the js heap of the current tab
+
+    def __init__(self, limit_mb: float=2048, debug_port: int=9222, chrome_command: str=None,
+                 restart_timeout: float=30):
+        self.limit = limit_mb * 1024 * 1024
+        self.debug_port = debug_port
+        self.chrome_command = chrome_command
+        self.restart_timeout = restart_timeout
+        self.restarts = 0
+        self.last_usage = 0
+
+    def browser_processes(self):
+        import psutil
+        flag = '--remote-debugging-port=%d' % self.debug_port
+        res = []
+        for proc in psutil.process_iter(['cmdline']):
+            cmdline = proc.info['cmdline'] or []
+            if flag in cmdline and not any(arg.startswith('--type=') for arg in cmdline):
+                res.append(proc)
+        return res
+
+    def usage(self, driver):
+        try:
+            import psutil
+        except ImportError:
+            try:
+                return driver.execute_script(
+                    'return window.performance && performance.memory ? performance.memory.usedJSHeapSize : 0;') or 0
+            except Exception:
+                return 0
+        total = 0
+        for proc in self.browser_processes():
+            try:
+                for p in [proc] + proc.children(recursive=True):
+                    total += p.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+
+    def over(self, driver):
+        self.last_usage = self.usage(driver)
+        return self.last_usage > self.limit
+
+    def wait_port(self):
+        deadline = time.time() + self.restart_timeout
+        while time.time() < deadline:
+            try:
+                with urlopen('http://127.0.0.1:%d/json/version' % self.debug_port, timeout=2):
+                    return True
+            except (URLError, OSError):
+                time.sleep(0.5)
+        return False
+
+    def restart(self):
+        # kills and relaunches the browser, only possible with psutil and the command that started it
+        if not self.chrome_command:
+            return False
+        try:
+            import psutil
+        except ImportError:
+            print("[-] restart browser needs psutil")
+            return False
+        procs = self.browser_processes()
+        for proc in procs:
+            try:
+                children = proc.children(recursive=True)
+                proc.terminate()
+                psutil.wait_procs([proc] + children, timeout=10)
+            except psutil.Error:
+                pass
+        subprocess.Popen(shlex.split(self.chrome_command), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not self.wait_port():
+            print("[-] browser on port %d not back after %ds" % (self.debug_port, self.restart_timeout))
+            return False
+        self.restarts += 1
+        return True
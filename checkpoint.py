@@ -0,0 +1,80 @@
+from pathlib import Path
+import json, os, time
+
+
+class Checkpoint:
+
+    def __init__(self, path: str, question: str, attempts: int=3):
+        self.path = path
+        self.question = question
+        self.page = 1
+        self.finished = False
+        self.mids = dict()
+        # mid -> [page, attempts] of posts left unfinished, a resume pages from the first of them again
+        self.unfinished = dict()
+        self.attempts = attempts
+        self.load()
+
+    def load(self):
+        if not Path(self.path).exists():
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print("[-] load checkpoint %s error: " % self.path, str(e))
+            return False
+        if state.get('question') != self.question:
+            return False
+        self.page = state.get('page', 1)
+        self.finished = state.get('finished', False)
+        self.mids = state.get('mids', dict())
+        self.unfinished = state.get('unfinished', dict())
+        return True
+
+    def save(self):
+        state = {
+            'question': self.question, 'page': self.page, 'finished': self.finished,
+            'updated': time.time(), 'mids': self.mids, 'unfinished': self.unfinished
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def restart(self):
+        # a fresh run keeps the harvested mids but pages from the start again
+        self.page = 1
+        self.finished = False
+
+    def set_page(self, page: int):
+        self.page = page
+        self.save()
+
+    def finish(self):
+        # not finished while posts wait for another attempt
+        self.finished = not self.unfinished
+        self.save()
+
+    def done(self, mid: str):
+        self.mids[mid] = time.time()
+        self.unfinished.pop(mid, None)
+
+    def leave(self, mid: str, page: int):
+        _, attempts = self.unfinished.get(mid, (page, 0))
+        if attempts + 1 >= self.attempts:
+            print("[-] post %s on page %d failed %d times, given up" % (mid, page, attempts + 1))
+            self.unfinished.pop(mid, None)
+            return False
+        self.unfinished[mid] = [page, attempts + 1]
+        return True
+
+    def resume_page(self):
+        return min([self.page] + [page for page, _ in self.unfinished.values()])
+
+    def is_done(self, mid: str, refresh_after: float=None):
+        if mid not in self.mids:
+            return False
+        if refresh_after is None:
+            return True
+        return time.time() - self.mids[mid] < refresh_after
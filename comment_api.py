@@ -0,0 +1,122 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urljoin
+import requests, logging
+
+
+def set_cookies(session: requests.Session, cookies: list):
+    for cookie in cookies:
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+
+def pooled_session(referer: str, cookies: list=None, user_agent: str=None, pool_size: int=8, retries: int=3):
+    # a requests session with the cookies and user agent of the logged in browser
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(418, 429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Referer'] = referer
+    if user_agent:
+        session.headers['User-Agent'] = user_agent
+    if cookies:
+        set_cookies(session, cookies)
+    return session
+
+
+class CommentApi:
+    # pages through weibo's json comment endpoint with the cookies of the logged in browser
+    comments_path = "ajax/statuses/buildComments"
+
+    def __init__(self, base_url: str="https://weibo.com/", cookies: list=None, user_agent: str=None,
+                 pool_size: int=8, workers: int=4, count: int=20, timeout: float=10, retries: int=3,
+                 max_pages: int=None, log_level=logging.DEBUG):
+        self.log = logging.getLogger(__name__)
+        self.log.setLevel(log_level)
+        self.base_url = base_url
+        self.count = count
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.session = pooled_session(base_url, cookies, user_agent, pool_size, retries)
+        self.session.headers.update({ 'Accept': 'application/json, text/plain, */*', 'X-Requested-With': 'XMLHttpRequest' })
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="comment-api")
+
+    @classmethod
+    def from_driver(cls, driver, **kwargs):
+        kwargs.setdefault('user_agent', driver.execute_script('return navigator.userAgent;'))
+        return cls(cookies=driver.get_cookies(), **kwargs)
+
+    def set_cookies(self, cookies: list):
+        set_cookies(self.session, cookies)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    @staticmethod
+    def comment_time(created_at: str):
+        # same format as the rendered comment times, e.g. 22-03-05 12:00
+        return datetime.strptime(created_at, "%a %b %d %H:%M:%S %z %Y").strftime("%y-%m-%d %H:%M")
+
+    def fetch_page(self, mid: str, uid: str, max_id: int):
+        params = { 'is_reload': 1, 'id': mid, 'is_show_bulletin': 2, 'is_mix': 0, 'count': self.count,
+                   'fetch_level': 0 }
+        if uid:
+            params['uid'] = uid
+        if max_id:
+            params['flow'] = 0
+            params['max_id'] = max_id
+        res = self.session.get(urljoin(self.base_url, self.comments_path), params=params, timeout=self.timeout)
+        res.raise_for_status()
+        return res.json()
+
+    def fetch(self, mid: str, uid: str=None):
+        # None when a page could not be fetched, partial comments are not passed on as a finished post
+        comments = { 'set': set(), 'comms': list(), 'finish': None }
+        max_id = 0
+        pages = 0
+        while True:
+            try:
+                data = self.fetch_page(mid, uid, max_id)
+            except (requests.RequestException, ValueError) as e:
+                self.log.warning("[-] [%s] fetch comments (max_id %s) failed: %s" % (mid, max_id, str(e)))
+                return None
+            if not isinstance(data, dict) or not isinstance(data.get('data') or [], list):
+                self.log.warning("[-] [%s] unexpected comments response (max_id %s): %.200r" % (mid, max_id, data))
+                return None
+            for comment in data.get('data') or []:
+                if not isinstance(comment, dict):
+                    continue
+                user = comment.get('user') if isinstance(comment.get('user'), dict) else {}
+                try:
+                    comment_time = self.comment_time(comment['created_at'])
+                except (KeyError, ValueError) as e:
+                    self.log.warning("[-] [%s] has bad comment time: %s" % (mid, str(e)))
+                    continue
+                comments['set'].add(len(comments['comms']))
+                comments['comms'].append((
+                    str(user.get('id', '')), user.get('screen_name', ''),
+                    user.get('avatar_large') or user.get('profile_image_url', ''),
+                    comment_time, comment.get('text_raw', comment.get('text', ''))
+                ))
+            pages += 1
+            max_id = data.get('max_id') or 0
+            if not max_id or not data.get('data'):
+                comments['finish'] = "api: %d/%s" % (len(comments['comms']), data.get('total_number', '?'))
+                break
+            if self.max_pages is not None and pages >= self.max_pages:
+                break
+        return comments
+
+    def submit(self, mid: str, uid: str=None):
+        return self.executor.submit(self.fetch, mid, uid)
+
+    def fetch_many(self, feeds: list):
+        # every post follows its own max_id cursor, posts are fetched concurrently,
+        # a post whose comments failed gets no 'comments'
+        futures = [(feed, self.submit(feed['mid'], feed.get('uid'))) for feed in feeds]
+        for feed, future in futures:
+            if (comments := future.result()) is not None:
+                feed['comments'] = comments
+        return feeds
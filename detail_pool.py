@@ -0,0 +1,172 @@
+from weibo import WeiboSpider
+import queue, threading, logging
+
+
+class AttachedSession:
+    # a lazily attached browser session, quit and attached again after max_failures failures in a row
+
+    def __init__(self, attach, release, max_failures: int=3, log=None, name: str='session', session=None):
+        self.attach = attach
+        self.release = release
+        self.max_failures = max_failures
+        self.log = log
+        self.name = name
+        self.session = session
+        self.failures = 0
+
+    def get(self):
+        if self.session is None:
+            self.session = self.attach()
+        return self.session
+
+    def replace(self, session):
+        # the holder moved on to another session by itself, e.g. a spider that restarted its browser
+        self.session = session
+
+    def succeeded(self):
+        self.failures = 0
+
+    def failed(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            # drop the session, the next job reattaches
+            self.drop()
+
+    def drop(self):
+        session, self.session = self.session, None
+        self.failures = 0
+        if session is None:
+            return
+        try:
+            self.release(session)
+        except Exception as e:
+            if self.log is not None:
+                self.log.warning("[-] %s release failed: %s" % (self.name, str(e)))
+
+
+def close_spider(spider: WeiboSpider):
+    spider.close()
+    spider.driver.quit()
+
+
+class DetailWorker(threading.Thread):
+
+    def __init__(self, pool, chromedriver_path: str, debug_port: int, log_level=logging.DEBUG, **spider_kwargs):
+        super().__init__(name=f"detail-{debug_port}", daemon=True)
+        self.pool = pool
+        self.chromedriver_path = chromedriver_path
+        self.debug_port = debug_port
+        self.log_level = log_level
+        self.spider_kwargs = spider_kwargs
+        self.session = AttachedSession(self.attach, close_spider, pool.max_failures, pool.log, self.name)
+
+    def attach(self):
+        # no comments_path: the worker never touches the database
+        return WeiboSpider(self.chromedriver_path, None, self.debug_port, self.log_level, **self.spider_kwargs)
+
+    def run(self):
+        while True:
+            job = self.pool.jobs.get()
+            if job is None:
+                self.pool.jobs.task_done()
+                break
+            token, index, feed = job
+            if token != self.pool.token:
+                # left over from a crawl that timed out
+                self.pool.jobs.task_done()
+                continue
+            try:
+                spider = self.session.get()
+            except Exception as e:
+                self.pool.log.error("[-] worker %d attach chrome failed: %s" % (self.debug_port, str(e)))
+                # give the job back to the other workers and retire
+                self.pool.jobs.put(job)
+                self.pool.jobs.task_done()
+                self.pool.retire(self)
+                break
+
+            ok = False
+            try:
+                ok = spider.open_detail(feed['link'], feed)
+            except Exception as e:
+                self.pool.log.warning("[-] worker %d detail [%s] failed: %s" % (self.debug_port, feed['link'], str(e)))
+                self.session.failed()
+            else:
+                self.session.succeeded()
+            finally:
+                self.pool.results.put((token, index, feed, ok))
+                self.pool.jobs.task_done()
+
+
+class DetailPool:
+
+    def __init__(self, chromedriver_path: str, debug_ports: list, concurrency: int=None, max_failures: int=3,
+                 log_level=logging.DEBUG, **spider_kwargs):
+        self.log = logging.getLogger(__name__)
+        self.log.setLevel(log_level)
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+        # results of an earlier, timed out crawl carry an old token and are dropped
+        self.token = 0
+        ports = list(debug_ports)
+        if concurrency is not None:
+            ports = ports[:concurrency]
+        self.workers = [
+            DetailWorker(self, chromedriver_path, port, log_level, **spider_kwargs) for port in ports
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def retire(self, worker: DetailWorker):
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+
+    def alive(self):
+        with self.lock:
+            return len(self.workers)
+
+    def crawl(self, feeds: list, timeout: float=600):
+        # blocks until every feed is scraped by some worker, the caller stays the only database writer.
+        # workers fill copies, only the results of this crawl are merged back into the feeds
+        with self.lock:
+            self.token += 1
+            token = self.token
+        pending = set()
+        for index, feed in enumerate(feeds):
+            pending.add(index)
+            self.jobs.put((token, index, dict(feed)))
+
+        idle = 0
+        while pending:
+            try:
+                res_token, index, res, ok = self.results.get(timeout=1)
+            except queue.Empty:
+                if self.alive() == 0:
+                    self.log.error("[-] no detail worker left, %d jobs dropped" % len(pending))
+                    break
+                idle += 1
+                if idle >= timeout:
+                    self.log.error("[-] detail pool timeout, %d jobs pending" % len(pending))
+                    break
+            else:
+                if res_token != token or index not in pending:
+                    continue
+                idle = 0
+                pending.discard(index)
+                feeds[index].update(res)
+                if not ok:
+                    self.log.warning("[-] detail [%s] not crawled" % feeds[index]['mid'])
+        with self.lock:
+            # late results of this crawl are ignored from now on
+            self.token += 1
+        return len(feeds) - len(pending)
+
+    def close(self):
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in list(self.workers):
+            worker.join()
+            worker.session.drop()
@@ -0,0 +1,139 @@
+from wb_data import WbData, content_filter
+from token_store import TokenStore
+from pathlib import Path
+import csv, argparse
+
+
+def dataset_query(name: str, start: str=None, end: str=None, mids: list=None, uids: list=None,
+                  keyword: str=None, skip_dups: bool=False, fts: bool=True):
+    # -> (database, columns, sql, params)
+    if name == 'words':
+        sql, params = TokenStore.query(start, end, mids, skip_dups)
+        return 'wb', ['term', 'count'], sql, params
+    if name == 'users':
+        columns = ['uid', 'nick', 'avator']
+        sql, params = 'SELECT uid, nick, avator FROM user', []
+        if uids:
+            sql += ' WHERE uid IN (%s)' % ', '.join('?' * len(uids))
+            params.extend(uids)
+        return 'user', columns, sql + ';', params
+
+    if name == 'messages':
+        table, columns = 'message', ['mid', 'uid', 'top', 'client', 'time', 'content']
+    elif name == 'comments':
+        table, columns = 'comment', ['mid', 'uid', 'time', 'content']
+    else:
+        raise ValueError("unknown dataset: %s" % name)
+    join, conds, params = content_filter(table, keyword, start, end, mids, uids, skip_dups, fts)
+    sql = 'SELECT %s FROM %s t%s' % (', '.join('t.' + c for c in columns), table, join)
+    if conds:
+        sql += ' WHERE ' + ' AND '.join(conds)
+    return 'wb', columns, sql + ';', params
+
+
+class CsvExporter:
+
+    def __init__(self, path: str, columns: list):
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows: list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxExporter:
+    # write-only workbooks keep no cells in memory
+    max_rows = 1048575
+
+    def __init__(self, path: str, columns: list, sheet_name: str='data'):
+        from openpyxl import Workbook
+        self.path = path
+        self.columns = columns
+        self.sheet_name = sheet_name
+        self.workbook = Workbook(write_only=True)
+        self.sheets = 0
+        self.add_sheet()
+
+    def add_sheet(self):
+        self.sheets += 1
+        title = self.sheet_name if self.sheets == 1 else '%s_%d' % (self.sheet_name, self.sheets)
+        self.sheet = self.workbook.create_sheet(title)
+        self.sheet.append(self.columns)
+        self.rows = 0
+
+    def write(self, rows: list):
+        for row in rows:
+            if self.rows >= self.max_rows:
+                self.add_sheet()
+            self.sheet.append(row)
+            self.rows += 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class ParquetExporter:
+
+    def __init__(self, path: str, columns: list, compression: str='zstd'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([ (c, pa.int64() if c == 'count' else pa.string()) for c in columns ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def write(self, rows: list):
+        data = { c: [ row[i] for row in rows ] for i, c in enumerate(self.columns) }
+        self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+exporters = { '.csv': CsvExporter, '.xlsx': XlsxExporter, '.parquet': ParquetExporter }
+
+def export(db: WbData, name: str, path: str, chunk_size: int=5000, labels: list=None, sheet_name: str=None,
+           **filters):
+    # labels replace the header row, sheet_name the xlsx sheet title
+    exporter_cls = exporters.get(Path(path).suffix.lower())
+    if exporter_cls is None:
+        raise ValueError("unsupported export format: %s" % path)
+    database, columns, sql, params = dataset_query(name, fts=db.fts, **filters)
+    options = { 'sheet_name': sheet_name } if sheet_name is not None else {}
+    exporter = exporter_cls(path, labels if labels is not None else columns, **options)
+    count = 0
+    try:
+        for rows in db.iter_rows(sql, params, chunk_size, database):
+            exporter.write(rows)
+            count += len(rows)
+    finally:
+        exporter.close()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', help="corpus database, e.g. 乌克兰.db")
+    parser.add_argument('dataset', choices=['messages', 'comments', 'users', 'words'])
+    parser.add_argument('output', help="output file, .csv/.xlsx/.parquet")
+    parser.add_argument('--user-db', default="users.sqlite")
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--mid', action='append', default=None)
+    parser.add_argument('--uid', action='append', default=None)
+    parser.add_argument('--keyword', default=None)
+    parser.add_argument('--skip-duplicates', action='store_true', help="leave out near duplicated posts and comments")
+    args = parser.parse_args()
+
+    with WbData(args.user_db, args.corpus) as db:
+        filters = { 'start': args.start, 'end': args.end, 'mids': args.mid, 'skip_dups': args.skip_duplicates }
+        if args.dataset in ('messages', 'comments'):
+            filters.update(uids=args.uid, keyword=args.keyword)
+        elif args.dataset == 'users':
+            filters = { 'uids': args.uid }
+        count = export(db, args.dataset, args.output, **filters)
+    print("[+] exported %d %s to %s" % (count, args.dataset, args.output))
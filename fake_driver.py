@@ -0,0 +1,332 @@
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import NoSuchElementException, NoSuchWindowException
+from lxml import etree
+from offline import OfflineParser, inner_text, has_class
+from snapshots import SnapshotArchive
+from weibo import WeiboSpider
+from urllib.parse import urlparse, parse_qs
+import wb_js
+import re, time, itertools
+
+
+def xpath_of(by: str, value: str):
+    if by == By.XPATH:
+        return value
+    if by == By.CLASS_NAME:
+        return './/*[%s]' % has_class(value)
+    if by == By.TAG_NAME:
+        return './/%s' % value
+    if by == By.CSS_SELECTOR and value.startswith('.') and ' ' not in value:
+        return './/*[%s]' % has_class(value[1:])
+    raise ValueError("fake driver does not support locator %s=%s" % (by, value))
+
+def item_element(item: dict):
+    # a rendered comment of the virtual scroller, the text lines separated like innerText
+    view = etree.Element('div', { 'class': 'vue-recycle-scroller__item-view' })
+    scroller = etree.SubElement(view, 'div', { 'class': 'wbpro-scroller-item', 'data-index': str(item['index']) })
+    if item.get('href'):
+        etree.SubElement(scroller, 'a', { 'href': item['href'] })
+    if item.get('avator'):
+        etree.SubElement(scroller, 'img', { 'class': 'woo-avatar-img', 'src': item['avator'] })
+    body = etree.SubElement(scroller, 'div')
+    lines = item['text'].split('\n')
+    body.text = lines[0]
+    for line in lines[1:]:
+        etree.SubElement(body, 'br').tail = line
+    return view
+
+
+class FakeElement:
+
+    def __init__(self, driver, elem):
+        self.driver = driver
+        self.elem = elem
+
+    def __eq__(self, other):
+        return isinstance(other, FakeElement) and other.elem is self.elem
+
+    def __hash__(self):
+        return id(self.elem)
+
+    @property
+    def tag_name(self):
+        return self.driver.execute('getElementTagName', { 'run': lambda: self.elem.tag })['value']
+
+    @property
+    def text(self):
+        return self.driver.execute('getElementText', { 'run': lambda: inner_text(self.elem) })['value']
+
+    def get_attribute(self, name: str):
+        return self.driver.execute('getElementAttribute', { 'run': lambda: self.elem.get(name) })['value']
+
+    def find_element(self, by=By.ID, value=None):
+        return self.driver.execute('findChildElement', { 'run': lambda: self.driver.locate(self.elem, by, value, True) })['value']
+
+    def find_elements(self, by=By.ID, value=None):
+        return self.driver.execute('findChildElements', { 'run': lambda: self.driver.locate(self.elem, by, value, False) })['value']
+
+    def send_keys(self, *keys):
+        def run():
+            if Keys.RETURN in ''.join(keys) or Keys.ENTER in ''.join(keys):
+                self.driver.follow(self.elem)
+        return self.driver.execute('sendKeysToElement', { 'run': run })['value']
+
+    def click(self):
+        return self.driver.execute('clickElement', { 'run': lambda: self.driver.follow(self.elem) })['value']
+
+
+class FakePage:
+    # one window of the fake browser, detail pages emulate the virtual comment scroller
+    search_base = "https://s.weibo.com/"
+
+    def __init__(self, url: str, source: str, kind: str, items: list=None, window: int=10, step: int=2):
+        self.url = url
+        self.kind = kind
+        self.window = window
+        self.step = step
+        self.pos = 0
+        self.observer = False
+        self.seen = set()
+        self.doc = OfflineParser.document(source, url)
+        self.items = []
+        self.container = None
+        self.bottom = None
+        if kind == 'detail':
+            self.setup_scroller(items)
+
+    def setup_scroller(self, items: list):
+        parser = OfflineParser()
+        self.items = items if items is not None else parser.comment_items_of(self.doc)
+        views = parser.comment_items(self.doc)
+        if views:
+            self.container = views[0].getparent()
+            for view in views:
+                view.getparent().remove(view)
+        else:
+            body = self.doc.find('body') if self.doc.find('body') is not None else self.doc
+            self.container = etree.SubElement(body, 'div', { 'class': 'vue-recycle-scroller__item-wrapper' })
+        if bottoms := parser.bottom(self.doc):
+            self.bottom = bottoms[0]
+            self.bottom.getparent().remove(self.bottom)
+        else:
+            self.bottom = etree.Element('div', { 'class': 'Bottom_text_fake' })
+            self.bottom.text = "没有更多内容了"
+        self.render()
+
+    def visible(self):
+        return self.items[self.pos:self.pos + self.window]
+
+    def finished(self):
+        return self.pos + self.window >= len(self.items)
+
+    def render(self):
+        if self.container is None:
+            return
+        for child in list(self.container):
+            self.container.remove(child)
+        for item in self.visible():
+            self.container.append(item_element(item))
+        if self.finished():
+            self.container.append(self.bottom)
+
+    def scroll(self, dy: int):
+        if self.kind != 'detail':
+            return
+        steps = max(1, abs(dy) // 100) * (1 if dy > 0 else -1)
+        self.pos = min(max(0, self.pos + steps), max(0, len(self.items) - self.window))
+        self.render()
+
+    def unseen(self):
+        res = []
+        for item in self.visible():
+            key = (item['index'], item['text'])
+            if key not in self.seen:
+                res.append(item)
+        return res
+
+    def drain(self):
+        # the in-page observer collects what is rendered, its timer scrolls on
+        items = self.unseen()
+        for item in items:
+            self.seen.add((item['index'], item['text']))
+        res = {
+            'items': [ dict(item) for item in items ],
+            'bottom': inner_text(self.bottom) if self.finished() else None,
+            'tips': [], 'rendered': len(self.visible())
+        }
+        self.scroll(self.step * 100)
+        return res
+
+
+class SwitchTo:
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle: str):
+        self.driver.execute('switchToWindow', { 'run': lambda: self.driver.switch(handle) })
+
+    def new_window(self, type_hint: str=None):
+        def run():
+            self.driver.switch(self.driver.new_window('about:blank'))
+        self.driver.execute('newWindow', { 'run': run })
+
+
+class FakeDriver:
+    # replays a SnapshotArchive of search and detail pages behind the WebDriver calls WeiboSpider uses,
+    # every call is one round trip of `latency` seconds, page loads add `load_latency`
+    scroll_pattern = re.compile(r'window\.scrollBy\(\s*0\s*,\s*(-?\d+)\s*\)')
+    page_pattern = re.compile(r'[?&]page=(\d+)')
+
+    def __init__(self, archive: SnapshotArchive, latency: float=0.002, load_latency: float=0.05,
+                 window: int=10, step: int=2):
+        self.archive = archive
+        self.latency = latency
+        self.load_latency = load_latency
+        self.page_window = window
+        self.page_step = step
+        self.handles = itertools.count()
+        self.windows = dict()
+        self.current = None
+        self.switch_to = SwitchTo(self)
+        self.details = dict()
+        parser = OfflineParser()
+        for _, source in archive.iter_search():
+            for card in parser.parse_search_page(source):
+                if card['link']:
+                    self.details[WeiboSpider.strip_link(card['link'])] = card['mid']
+        self.current = self.new_window('about:blank')
+
+    def execute(self, driver_command: str, params: dict=None):
+        time.sleep(self.latency)
+        run = (params or {}).get('run')
+        return { 'value': run() if run is not None else None }
+
+    def load(self, url: str):
+        time.sleep(self.load_latency)
+        if url.startswith(FakePage.search_base):
+            query = parse_qs(urlparse(url).query)
+            question = query.get('q', [''])[0]
+            page = int(m.group(1)) if (m := self.page_pattern.search(url)) else 1
+            for key, source in self.archive.iter_search(question):
+                if key == SnapshotArchive.search_key(question, page):
+                    return FakePage(url, source, 'search')
+        elif (mid := self.details.get(WeiboSpider.strip_link(url))) is not None:
+            source, items = self.archive.load_detail(mid)
+            if source is not None:
+                return FakePage(url, source, 'detail', items, self.page_window, self.page_step)
+        return FakePage(url, '<html><body></body></html>', 'blank')
+
+    def new_window(self, url: str):
+        handle = 'fake-%d' % next(self.handles)
+        self.windows[handle] = self.load(url)
+        return handle
+
+    def page(self):
+        if self.current not in self.windows:
+            raise NoSuchWindowException("no such window: %s" % self.current)
+        return self.windows[self.current]
+
+    def switch(self, handle: str):
+        if handle not in self.windows:
+            raise NoSuchWindowException("no such window: %s" % handle)
+        self.current = handle
+
+    def follow(self, elem):
+        href = elem.get('href')
+        if elem.tag != 'a' or not href:
+            return
+        if elem.get('target') == '_blank':
+            self.new_window(href)
+        else:
+            self.windows[self.current] = self.load(href)
+
+    def locate(self, root, by: str, value: str, single: bool):
+        found = [ FakeElement(self, e) for e in root.xpath(xpath_of(by, value)) if isinstance(e.tag, str) ]
+        if single:
+            if not found:
+                raise NoSuchElementException("no such element: %s=%s" % (by, value))
+            return found[0]
+        return found
+
+    def script(self, script: str, args: tuple):
+        page = self.page()
+        if script == wb_js.EXTRACT_CARDS:
+            return OfflineParser().parse_search_doc(page.doc, lambda e: FakeElement(self, e))
+        if script == wb_js.COMMENT_OBSERVER:
+            if page.observer:
+                return False
+            page.observer = True
+            return True
+        if script == wb_js.DRAIN_COMMENTS:
+            return page.drain() if page.observer else None
+        if script == wb_js.COMMENTS_BUFFERED:
+            if not page.observer:
+                return -1
+            if not page.unseen():
+                page.scroll(page.step * 100)
+            return len(page.unseen())
+        if script == wb_js.STOP_COMMENT_OBSERVER:
+            page.observer = False
+            return None
+        if 'vue-recycle-scroller__item-view' in script and '.length' in script:
+            return len(page.visible())
+        if "getEntriesByType('resource')" in script:
+            return ['complete', 0]
+        if 'document.readyState' in script:
+            return 'complete'
+        if 'navigator.userAgent' in script:
+            return 'FakeDriver'
+        if m := self.scroll_pattern.search(script):
+            page.scroll(int(m.group(1)))
+        return None
+
+    @property
+    def current_url(self):
+        return self.execute('getCurrentUrl', { 'run': lambda: self.page().url })['value']
+
+    @property
+    def page_source(self):
+        return self.execute('getPageSource', {
+            'run': lambda: etree.tostring(self.page().doc, encoding='unicode', method='html') })['value']
+
+    @property
+    def current_window_handle(self):
+        return self.execute('getCurrentWindowHandle', { 'run': lambda: self.current })['value']
+
+    @property
+    def window_handles(self):
+        return self.execute('getWindowHandles', { 'run': lambda: list(self.windows) })['value']
+
+    def get(self, url: str):
+        def run():
+            self.windows[self.current] = self.load(url)
+        self.execute('get', { 'run': run })
+
+    def refresh(self):
+        self.get(self.page().url)
+
+    def close(self):
+        def run():
+            self.page()
+            del self.windows[self.current]
+        self.execute('closeWindow', { 'run': run })
+
+    def quit(self):
+        self.windows.clear()
+
+    def get_cookies(self):
+        return self.execute('getAllCookies', { 'run': lambda: [] })['value']
+
+    def find_element(self, by=By.ID, value=None):
+        return self.execute('findElement', { 'run': lambda: self.locate(self.page().doc, by, value, True) })['value']
+
+    def find_elements(self, by=By.ID, value=None):
+        return self.execute('findElements', { 'run': lambda: self.locate(self.page().doc, by, value, False) })['value']
+
+    def execute_script(self, script: str, *args):
+        return self.execute('executeScript', { 'run': lambda: self.script(script, args) })['value']
+
+    def execute_cdp_cmd(self, cmd: str, cmd_args: dict):
+        return self.execute('executeCdpCommand', { 'run': lambda: {} })['value']
@@ -0,0 +1,159 @@
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+import threading, time, json, os
+
+
+class Metrics:
+    # webdriver round trips, stage timings and throughput counters, safe to share between threads
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.commands = dict()
+        self.stages = dict()
+        self.counters = dict()
+
+    @staticmethod
+    def add(table: dict, name: str, elapsed: float):
+        stat = table.get(name)
+        if stat is None:
+            stat = table[name] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += elapsed
+        if elapsed > stat[2]:
+            stat[2] = elapsed
+
+    def instrument(self, driver):
+        # every WebDriver command goes through driver.execute, a reused driver is timed by the latest metrics only
+        execute = getattr(driver, 'untimed_execute', None) or driver.execute
+        driver.untimed_execute = execute
+        def timed_execute(driver_command, params=None):
+            start = time.perf_counter()
+            try:
+                return execute(driver_command, params)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.add(self.commands, driver_command, elapsed)
+        driver.execute = timed_execute
+        return driver
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, elapsed: float):
+        with self.lock:
+            self.add(self.stages, name, elapsed)
+
+    def count(self, name: str, n: int=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.started
+            res = {
+                'uptime': uptime,
+                'round_trips': sum(stat[0] for stat in self.commands.values()),
+                'commands': { k: { 'count': v[0], 'total': v[1], 'max': v[2] } for k, v in self.commands.items() },
+                'stages': { k: { 'count': v[0], 'total': v[1], 'max': v[2] } for k, v in self.stages.items() },
+                'counters': dict(self.counters),
+            }
+        posts = res['counters'].get('posts', 0)
+        comments = res['counters'].get('comments', 0)
+        res['posts_per_min'] = posts * 60 / uptime if uptime > 0 else 0.0
+        res['comments_per_sec'] = comments / uptime if uptime > 0 else 0.0
+        return res
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def to_prometheus(self):
+        snap = self.snapshot()
+        lines = []
+        def metric(name: str, kind: str, samples: list):
+            lines.append('# TYPE weibo_%s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('weibo_%s%s %s' % (name, labels, value))
+        def label(key: str, value: str):
+            return '{%s="%s"}' % (key, value.replace('\\', '\\\\').replace('"', '\\"'))
+
+        metric('webdriver_commands_total', 'counter',
+               [ (label('command', k), v['count']) for k, v in snap['commands'].items() ])
+        metric('webdriver_command_seconds_total', 'counter',
+               [ (label('command', k), '%.6f' % v['total']) for k, v in snap['commands'].items() ])
+        metric('stage_calls_total', 'counter',
+               [ (label('stage', k), v['count']) for k, v in snap['stages'].items() ])
+        metric('stage_seconds_total', 'counter',
+               [ (label('stage', k), '%.6f' % v['total']) for k, v in snap['stages'].items() ])
+        for k, v in snap['counters'].items():
+            metric('%s_total' % k, 'counter', [('', v)])
+        metric('posts_per_minute', 'gauge', [('', '%.3f' % snap['posts_per_min'])])
+        metric('comments_per_second', 'gauge', [('', '%.3f' % snap['comments_per_sec'])])
+        metric('uptime_seconds', 'gauge', [('', '%.1f' % snap['uptime'])])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        snap = self.snapshot()
+        lines = [ "[.] %d posts, %d comments in %.1fs (%.2f posts/min, %.2f comments/s), %d webdriver round trips" % (
+            snap['counters'].get('posts', 0), snap['counters'].get('comments', 0), snap['uptime'],
+            snap['posts_per_min'], snap['comments_per_sec'], snap['round_trips']) ]
+        for name, stat in sorted(snap['stages'].items(), key=lambda kv: -kv[1]['total']):
+            lines.append("    stage %-18s %6d calls %10.2fs total %8.3fs max" % (
+                name, stat['count'], stat['total'], stat['max']))
+        for name, stat in sorted(snap['commands'].items(), key=lambda kv: -kv[1]['total'])[:10]:
+            lines.append("    command %-16s %6d calls %10.2fs total %8.3fs max" % (
+                name, stat['count'], stat['total'], stat['max']))
+        return '\n'.join(lines)
+
+
+def timed(stage: str):
+    # times a WeiboSpider method as a stage of self.metrics
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(stage):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Reporter(threading.Thread):
+    # writes the metrics every interval seconds, json or prometheus text, to a file or the log
+
+    def __init__(self, metrics: Metrics, interval: float=60, path: str=None, fmt: str='json', log=None):
+        super().__init__(name="metrics-reporter", daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.path = path
+        self.fmt = fmt
+        self.log = log
+        self.stopped = threading.Event()
+
+    def report(self):
+        text = self.metrics.to_prometheus() if self.fmt == 'prometheus' else self.metrics.to_json()
+        if self.path is not None:
+            tmp_path = str(self.path) + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, Path(self.path))
+        elif self.log is not None:
+            self.log.info("[.] metrics: %s" % text)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        self.report()
+        if self.log is not None:
+            self.log.info(self.metrics.summary())
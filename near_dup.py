@@ -0,0 +1,126 @@
+from wb_data import open_cursor, doc_sources, read_watermark, write_watermark, iter_doc_chunks
+from array import array
+import sqlite3, random, zlib, re
+
+mention_pattern = re.compile(r'//@[^:：\s]+[:：]?|@[^:：\s]+|\s+')
+_prime = (1 << 61) - 1
+_mask = (1 << 32) - 1
+
+
+def normalize(content: str):
+    # repost chains and mentions differ between copies of the same text
+    return mention_pattern.sub('', content or '').lower()
+
+def shingles(text: str, size: int=3):
+    if len(text) <= size:
+        return { text }
+    return { text[i:i + size] for i in range(len(text) - size + 1) }
+
+
+class MinHash:
+
+    def __init__(self, num_perm: int=64, seed: int=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.perms = [ (rng.randrange(1, _prime), rng.randrange(0, _prime)) for _ in range(num_perm) ]
+
+    def signature(self, tokens: set):
+        hashes = [ zlib.crc32(token.encode('utf-8')) for token in tokens ]
+        return array('I', [ min((a * h + b) % _prime for h in hashes) & _mask for a, b in self.perms ])
+
+    @staticmethod
+    def similarity(sig1, sig2):
+        return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+
+class NearDupIndex:
+    # streaming minhash/lsh over message and comment texts, persisted in the corpus database.
+    # rows past the watermark are signed, looked up in the lsh buckets and tagged with dup_of,
+    # only originals are bucketed so dup_of always points at the first copy
+
+    def __init__(self, num_perm: int=64, bands: int=16, threshold: float=0.8, shingle: int=3, min_length: int=10,
+                 collapse: bool=False, chunk_size: int=1000):
+        if num_perm % bands:
+            raise ValueError("num_perm %d is not a multiple of bands %d" % (num_perm, bands))
+        self.minhash = MinHash(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle = shingle
+        self.min_length = min_length
+        # collapse deletes duplicated comments, posts are only tagged since their comments refer to them
+        self.collapse = collapse
+        self.chunk_size = chunk_size
+        self.config = "%d/%d/%d" % (num_perm, bands, shingle)
+
+    def create_tables(self, conn: sqlite3.Connection):
+        with conn:
+            with open_cursor(conn) as cursor:
+                cursor.execute("CREATE TABLE IF NOT EXISTS dup_signature(source varchar(16) NOT NULL, \
+                    ref varchar(16) NOT NULL, sig blob NOT NULL, PRIMARY KEY(source, ref));")
+                cursor.execute("CREATE TABLE IF NOT EXISTS dup_band(source varchar(16) NOT NULL, band integer NOT NULL, \
+                    bucket integer NOT NULL, ref varchar(16) NOT NULL);")
+                cursor.execute('CREATE INDEX IF NOT EXISTS dup_band_bucket ON dup_band(source, band, bucket);')
+                cursor.execute("CREATE TABLE IF NOT EXISTS dup_watermark(source varchar(16) PRIMARY KEY NOT NULL, \
+                    last_rowid integer NOT NULL, config varchar(32) NOT NULL);")
+                cursor.execute('SELECT DISTINCT config FROM dup_watermark;')
+                if any(row[0] != self.config for row in cursor.fetchall()):
+                    # signatures of other parameters do not compare, the index is built again
+                    print("[.] near duplicate index parameters changed, rebuild as %s" % self.config)
+                    cursor.execute('DELETE FROM dup_signature;')
+                    cursor.execute('DELETE FROM dup_band;')
+                    cursor.execute('DELETE FROM dup_watermark;')
+                    cursor.execute('UPDATE message SET dup_of = NULL;')
+                    cursor.execute('UPDATE comment SET dup_of = NULL;')
+
+    def buckets(self, sig: array):
+        return [ zlib.crc32(sig[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands) ]
+
+    def find(self, cursor: sqlite3.Cursor, source: str, sig: array, buckets: list):
+        candidates = set()
+        for band, bucket in enumerate(buckets):
+            cursor.execute('SELECT ref FROM dup_band WHERE source = ? AND band = ? AND bucket = ?;',
+                           (source, band, bucket))
+            candidates.update(row[0] for row in cursor.fetchall())
+        best, best_sim = None, self.threshold
+        for ref in candidates:
+            cursor.execute('SELECT sig FROM dup_signature WHERE source = ? AND ref = ?;', (source, ref))
+            if (row := cursor.fetchone()) is None:
+                continue
+            if (sim := MinHash.similarity(sig, array('I', row[0]))) >= best_sim:
+                best, best_sim = ref, sim
+        return best
+
+    def add(self, cursor: sqlite3.Cursor, source: str, ref: str, sig: array, buckets: list):
+        cursor.execute('INSERT or REPLACE INTO dup_signature values(?, ?, ?);', (source, ref, sig.tobytes()))
+        cursor.executemany('INSERT INTO dup_band values(?, ?, ?, ?);',
+                           [ (source, band, bucket, ref) for band, bucket in enumerate(buckets) ])
+
+    def update(self, conn: sqlite3.Connection):
+        # runs inside the caller's insert transaction, returns the number of rows tagged as duplicates
+        dups = 0
+        with open_cursor(conn) as cursor:
+            for source in doc_sources:
+                last_rowid = read_watermark(cursor, 'dup_watermark', source)
+                # collapsed rows at the end of the table give their rowids to the next inserts
+                cursor.execute('SELECT COALESCE(MAX(rowid), 0) FROM %s;' % source)
+                last_rowid = min(last_rowid, cursor.fetchone()[0])
+                for rows in iter_doc_chunks(conn, source, last_rowid, self.chunk_size):
+                    for rowid, ref, content in rows:
+                        text = normalize(content)
+                        if len(text) < self.min_length:
+                            continue
+                        sig = self.minhash.signature(shingles(text, self.shingle))
+                        buckets = self.buckets(sig)
+                        ref = str(ref)
+                        if (original := self.find(cursor, source, sig, buckets)) is None:
+                            self.add(cursor, source, ref, sig, buckets)
+                            continue
+                        dups += 1
+                        if source == 'comment' and self.collapse:
+                            cursor.execute('DELETE FROM comment WHERE rowid = ?;', (rowid,))
+                        else:
+                            cursor.execute('UPDATE %s SET dup_of = ? WHERE rowid = ?;' % source, (original, rowid))
+                    last_rowid = rows[-1][0]
+                write_watermark(cursor, 'dup_watermark', source, last_rowid, self.config)
+        return dups
@@ -0,0 +1,197 @@
+from lxml import etree, html
+from wb_data import WbData
+from wb_parse import parse_user_link, parse_comment_item
+from sinks import DbSink
+from snapshots import SnapshotArchive
+import logging, argparse
+
+
+def has_class(name: str):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+block_tags = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'footer', 'form', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul'
+}
+skip_tags = { 'script', 'style', 'noscript', 'template' }
+
+def inner_text(elem):
+    # close to the rendered innerText selenium returns: blocks on their own lines, whitespace collapsed
+    parts = []
+    def walk(e, top=False):
+        if isinstance(e.tag, str) and e.tag not in skip_tags:
+            block = e.tag in block_tags
+            if block:
+                parts.append('\n')
+            if e.text:
+                parts.append(e.text)
+            for child in e:
+                walk(child)
+            if block:
+                parts.append('\n')
+        if e.tail and not top:
+            parts.append(e.tail)
+    walk(elem, True)
+    lines = (' '.join(line.split()) for line in ''.join(parts).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+def first(elems: list):
+    return elems[0] if elems else None
+
+
+class OfflineParser:
+    search_base = "https://s.weibo.com/"
+    detail_base = "https://weibo.com/"
+
+    feed_items = etree.XPath('//div[@action-type="feed_list_item"]')
+    card_top = etree.XPath('.//*[%s]' % has_class('card-top'))
+    card = etree.XPath('.//*[%s]' % has_class('card'))
+    card_feed = etree.XPath('.//*[%s]' % has_class('card-feed'))
+    avator = etree.XPath('.//*[%s]' % has_class('avator'))
+    name = etree.XPath('.//*[%s]' % has_class('name'))
+    source = etree.XPath('.//*[%s]' % has_class('from'))
+    links = etree.XPath('.//a')
+    imgs = etree.XPath('.//img')
+    next_link = etree.XPath('//a[%s]' % has_class('next'))
+
+    info_time = etree.XPath('//a[contains(@class, "head-info_time")]')
+    wbtext = etree.XPath('//div[starts-with(@class, "detail_wbtext_")]')
+    comment_items = etree.XPath('//*[%s]' % has_class('vue-recycle-scroller__item-view'))
+    scroller_item = etree.XPath('.//*[%s]' % has_class('wbpro-scroller-item'))
+    avator_img = etree.XPath('.//*[%s]' % has_class('woo-avatar-img'))
+    bottom = etree.XPath("//div[starts-with(@class, 'Bottom_text_')]")
+
+    def __init__(self, log_level=logging.DEBUG):
+        self.log = logging.getLogger(__name__)
+        self.log.setLevel(log_level)
+
+    @staticmethod
+    def document(source: str, base_url: str):
+        doc = html.fromstring(source, base_url=base_url)
+        doc.make_links_absolute(base_url)
+        return doc
+
+    def parse_search_page(self, source: str):
+        return self.parse_search_doc(self.document(source, self.search_base))
+
+    def parse_search_doc(self, doc, wrap=None):
+        # the same card dicts wb_js.EXTRACT_CARDS returns, element references only when wrap is given
+        cards = []
+        for item in self.feed_items(doc):
+            mid = item.get('mid')
+            if mid is None:
+                continue
+            top = first(self.card_top(item))
+            card = first(self.card(item))
+            feed = first(self.card_feed(card)) if card is not None else None
+            res = {
+                'mid': mid, 'top': inner_text(top) if top is not None else '', 'has_card': card is not None,
+                'feed': None, 'user_link': None, 'avator': None, 'nick_name': None, 'from': None, 'link': None,
+                'link_elem': None, 'has_avator': False, 'has_from': False, 'has_feed': feed is not None
+            }
+            if feed is not None:
+                if wrap is not None:
+                    res['feed'] = wrap(feed)
+                if (avator := first(self.avator(feed))) is not None:
+                    res['has_avator'] = True
+                    if (user_link := first(self.links(avator))) is not None:
+                        res['user_link'] = user_link.get('href')
+                    if (img := first(self.imgs(avator))) is not None:
+                        res['avator'] = img.get('src')
+                if (name := first(self.name(feed))) is not None:
+                    res['nick_name'] = name.get('nick-name')
+                if (source_elem := first(self.source(feed))) is not None:
+                    res['has_from'] = True
+                    links = self.links(source_elem)
+                    res['from'] = inner_text(links[-1]) if len(links) > 1 else ''
+                    if links:
+                        res['link'] = links[0].get('href')
+                        if wrap is not None:
+                            res['link_elem'] = wrap(links[0])
+            cards.append(res)
+        return cards
+
+    def has_next(self, doc):
+        return len(self.next_link(doc)) > 0
+
+    def card_feed_dict(self, card: dict):
+        feed = { 'mid': card['mid'], 'top': card['top'] or '' }
+        if card['user_link'] is not None and (uid := parse_user_link(card['user_link'])) is not None:
+            feed['uid'] = uid
+        if card['avator'] is not None:
+            feed['avator'] = card['avator']
+        if card['nick_name'] is not None:
+            feed['nick_name'] = card['nick_name']
+        if card['has_from']:
+            feed['from'] = card['from']
+        if card['link'] is not None:
+            feed['link'] = card['link']
+        return feed
+
+    def comment_items_of(self, doc):
+        items = []
+        for item in self.comment_items(doc):
+            if (scroller := first(self.scroller_item(item))) is None:
+                continue
+            link = first(self.links(scroller))
+            avator = first(self.avator_img(item))
+            items.append({
+                'index': scroller.get('data-index'), 'text': inner_text(item),
+                'href': link.get('href') if link is not None else None,
+                'avator': avator.get('src') if avator is not None else None
+            })
+        return items
+
+    def parse_detail_page(self, source: str, feed: dict, items: list=None):
+        # items are the scroller items harvested live, the page source only holds the rendered ones
+        doc = self.document(source, self.detail_base)
+        if (info_time := first(self.info_time(doc))) is not None:
+            feed['time'] = inner_text(info_time)
+        else:
+            self.log.warning("[-] [%s] not has info time" % feed['mid'])
+        if (wbtext := first(self.wbtext(doc))) is not None:
+            feed['content'] = inner_text(wbtext)
+        else:
+            self.log.warning("[-] [%s] not has detail webtext" % feed['mid'])
+
+        feed['comments'] = { 'set': set(), 'comms': list(), 'finish': None }
+        if (bottom := first(self.bottom(doc))) is not None:
+            feed['comments']['finish'] = inner_text(bottom)
+        comments_set = set()
+        for item in items if items is not None else self.comment_items_of(doc):
+            try:
+                parse_comment_item(item, feed['comments'], comments_set)
+            except (TypeError, ValueError) as e:
+                self.log.warning("[-] [%s] has value error: %s" % (feed['mid'], str(e)))
+        return feed
+
+    def reparse(self, archive: SnapshotArchive, question: str=None, sinks: list=None):
+        sinks = sinks or []
+        for key, source in archive.iter_search(question):
+            for card in self.parse_search_page(source):
+                feed = self.card_feed_dict(card)
+                detail, items = archive.load_detail(feed['mid'])
+                if detail is None:
+                    continue
+                self.parse_detail_page(detail, feed, items)
+                if not all(k in feed for k in ('uid', 'nick_name', 'avator', 'from', 'time', 'content')):
+                    self.log.warning("[-] [%s](%s) incomplete feed skipped" % (feed['mid'], key))
+                    continue
+                for sink in sinks:
+                    sink.write(feed)
+                yield feed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archive', help="snapshot directory written by WeiboSpider(snapshots=...)")
+    parser.add_argument('question', nargs='?', default=None)
+    parser.add_argument('--db', default=None, help="corpus database the feeds are written to")
+    args = parser.parse_args()
+
+    db = WbData("users.sqlite", args.db, write_behind=True) if args.db else None
+    sinks = [DbSink(db)] if db is not None else []
+    count = sum(1 for _ in OfflineParser().reparse(SnapshotArchive(args.archive), args.question, sinks))
+    if db is not None:
+        db.close()
+    print("[+] reparsed %d feeds" % count)
@@ -0,0 +1,108 @@
+from offline import OfflineParser
+from comment_api import pooled_session
+from urllib.parse import quote
+from lxml import etree
+import threading, queue, logging, requests
+
+
+class SearchPrefetcher(threading.Thread):
+    # fetches the result pages over http ahead of the crawl and parses their cards offline,
+    # at most `lookahead` parsed pages wait in the queue while the browser scrapes details
+    search_url = "https://s.weibo.com/weibo?q="
+
+    def __init__(self, question: str, page: int=1, lookahead: int=2, cookies: list=None, user_agent: str=None,
+                 timeout: float=15, retries: int=3, wait: float=120, metrics=None, log_level=logging.DEBUG):
+        super().__init__(name="search-prefetch", daemon=True)
+        self.log = logging.getLogger(__name__)
+        self.log.setLevel(log_level)
+        self.question = question
+        self.page = page
+        self.timeout = timeout
+        # seconds get() waits for a page before the browser takes over
+        self.wait = wait
+        self.expected = page
+        self.metrics = metrics
+        self.parser = OfflineParser(log_level)
+        self.session = pooled_session("https://s.weibo.com/", cookies, user_agent, 2, retries)
+        self.pages = queue.Queue(maxsize=max(1, lookahead))
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_driver(cls, driver, question: str, page: int=1, **kwargs):
+        kwargs.setdefault('user_agent', driver.execute_script('return navigator.userAgent;'))
+        return cls(question, page, cookies=driver.get_cookies(), **kwargs)
+
+    def url(self, page: int):
+        url = self.search_url + quote(self.question)
+        if page > 1:
+            url += "&page=%d" % page
+        return url
+
+    def fetch(self, page: int):
+        # (page, cards, has_next, source), cards is None when the page could not be fetched or parsed
+        try:
+            res = self.session.get(self.url(page), timeout=self.timeout)
+            res.raise_for_status()
+            doc = self.parser.document(res.text, self.parser.search_base)
+            cards = self.parser.parse_search_doc(doc)
+        except (requests.RequestException, ValueError, etree.LxmlError) as e:
+            self.log.warning("[-] prefetch %s page %d failed: %s" % (self.question, page, str(e)))
+            return page, None, False, None
+        if not cards:
+            # a login wall or captcha has no cards either, the browser takes over
+            self.log.warning("[-] prefetch %s page %d has no cards" % (self.question, page))
+            return page, None, False, res.text
+        return page, cards, self.parser.has_next(doc), res.text
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        page = self.page
+        try:
+            while not self.stopped.is_set():
+                if self.metrics is not None:
+                    with self.metrics.stage('prefetch'):
+                        item = self.fetch(page)
+                else:
+                    item = self.fetch(page)
+                if not self.put(item):
+                    break
+                _, cards, has_next, _ = item
+                if cards is None or not has_next:
+                    break
+                page += 1
+        except Exception as e:
+            self.log.error("[-] prefetch %s stopped at page %d: %s" % (self.question, page, str(e)))
+            self.put((page, None, False, None))
+        finally:
+            # the end marker, the consumer never waits on a dead thread
+            self.put(None)
+
+    def get(self, timeout: float=None):
+        # a page that is not there in time comes back unfetched, the browser pages on from it
+        try:
+            item = self.pages.get(timeout=timeout if timeout is not None else self.wait)
+        except queue.Empty:
+            self.log.warning("[-] prefetch %s page %d timed out" % (self.question, self.expected))
+            return self.expected, None, False, None
+        if item is not None:
+            self.expected = item[0] + 1
+        return item
+
+    def stop(self):
+        self.stopped.set()
+        while True:
+            try:
+                self.pages.get_nowait()
+            except queue.Empty:
+                break
+        if self.is_alive():
+            self.join(self.timeout + 1)
+        self.session.close()
@@ -0,0 +1,279 @@
+from weibo import WeiboSpider
+from wb_data import WbData
+from checkpoint import Checkpoint
+from sinks import DbSink
+from metrics import Metrics
+from detail_pool import AttachedSession
+from pathlib import Path
+import threading, itertools, logging, argparse, json, time, os
+
+
+class RateLimiter:
+    # token bucket over crawled pages, a query that runs out waits while the others are scheduled
+
+    def __init__(self, pages_per_minute: float=None, burst: int=None):
+        self.rate = pages_per_minute / 60 if pages_per_minute else None
+        self.burst = burst if burst is not None else max(1, int(pages_per_minute or 1))
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+
+    def refill(self):
+        now = time.time()
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, pages: int=1):
+        if self.rate is None:
+            return 0.0
+        self.refill()
+        pages = min(pages, self.burst)
+        if self.tokens >= pages:
+            return 0.0
+        return self.updated + (pages - self.tokens) / self.rate
+
+    def take(self, pages: int):
+        if self.rate is not None:
+            self.refill()
+            self.tokens -= pages
+
+
+class Query:
+
+    def __init__(self, question: str, priority: int=0, max_pages: int=None, pages_per_minute: float=None,
+                 path: str=None):
+        self.question = question
+        self.priority = priority
+        self.max_pages = max_pages
+        self.limiter = RateLimiter(pages_per_minute)
+        self.path = path if path is not None else question.replace(' ', '_')
+        self.checkpoint = None
+        self.db = None
+        self.metrics = Metrics()
+        self.state = 'pending'
+        self.running = False
+        self.slices = 0
+        self.failures = 0
+        self.started = None
+        self.elapsed = 0.0
+
+    def open(self, restart: bool=False):
+        if self.checkpoint is None:
+            self.checkpoint = Checkpoint(self.path + '.checkpoint.json', self.question)
+            if restart:
+                self.checkpoint.restart()
+        if self.db is None:
+            self.db = WbData("users.sqlite", self.path + '.db', write_behind=True)
+            self.db.set_metrics(self.metrics)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def finished(self):
+        if self.checkpoint is None:
+            return False
+        if self.checkpoint.finished:
+            return True
+        return self.max_pages is not None and self.checkpoint.resume_page() > self.max_pages
+
+    def slice_pages(self, slice_pages: int):
+        if self.max_pages is None:
+            return slice_pages
+        return max(1, min(slice_pages, self.max_pages - self.checkpoint.resume_page() + 1))
+
+    def progress(self):
+        counters = self.metrics.snapshot()['counters']
+        return {
+            'question': self.question, 'state': self.state, 'priority': self.priority,
+            'page': self.checkpoint.page if self.checkpoint is not None else 1, 'max_pages': self.max_pages,
+            'slices': self.slices, 'posts': counters.get('posts', 0), 'comments': counters.get('comments', 0),
+            'elapsed': round(self.elapsed, 1),
+        }
+
+
+def load_queries(path: str):
+    # one query per line: question[<tab>priority[<tab>max_pages[<tab>pages_per_minute]]], or a json object
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                queries.append(Query(**json.loads(line)))
+                continue
+            fields = line.split('\t')
+            try:
+                queries.append(Query(
+                    fields[0],
+                    int(fields[1]) if len(fields) > 1 and fields[1] else 0,
+                    int(fields[2]) if len(fields) > 2 and fields[2] else None,
+                    float(fields[3]) if len(fields) > 3 and fields[3] else None,
+                ))
+            except ValueError as e:
+                print("[-] bad query line %r: " % line, str(e))
+    return queries
+
+
+class Session(threading.Thread):
+    # one attached browser, reused for every query slice it is given
+
+    def __init__(self, scheduler, chromedriver_path: str, debug_port: int, driver=None):
+        super().__init__(name=f"session-{debug_port}", daemon=True)
+        self.scheduler = scheduler
+        self.chromedriver_path = chromedriver_path
+        self.debug_port = debug_port
+        # a driver handed in is used until it fails, then the session attaches its own
+        self.session = AttachedSession(self.attach, lambda driver: driver.quit(), scheduler.max_failures,
+                                       scheduler.log, self.name, driver)
+
+    def attach(self):
+        return WeiboSpider.attach_driver(self.chromedriver_path, self.debug_port)
+
+    def crawl(self, query: Query, pages: int):
+        spider = WeiboSpider(None, None, log_level=self.scheduler.log_level, driver=self.session.get(),
+                             checkpoint=query.checkpoint, refresh_after=self.scheduler.refresh_after,
+                             metrics=query.metrics, db=query.db, sinks=[DbSink(query.db)],
+                             **self.scheduler.spider_kwargs)
+        try:
+            with spider:
+                return spider.resume(query.question, pages)
+        finally:
+            # a restarted browser comes back with a new driver
+            self.session.replace(spider.driver)
+
+    def run(self):
+        while (job := self.scheduler.next_job()) is not None:
+            query, pages = job
+            ok = False
+            try:
+                ok = self.crawl(query, pages)
+            except Exception as e:
+                self.scheduler.log.warning("[-] session %d: %s failed: %s" % (self.debug_port, query.question, str(e)))
+                self.session.failed()
+            else:
+                self.session.succeeded()
+            self.scheduler.release(query, ok)
+        self.session.drop()
+
+
+class BatchScheduler:
+    # runs many queries over the available browser sessions in slices of a few pages,
+    # higher priority first, and among equals the query that had the fewest slices
+
+    def __init__(self, queries: list, chromedriver_path: str, debug_ports: list, slice_pages: int=2,
+                 max_failures: int=3, restart: bool=False, refresh_after: float=None, progress_path: str=None,
+                 log_level=logging.DEBUG, drivers: list=None, **spider_kwargs):
+        self.log = logging.getLogger(__name__)
+        self.log.setLevel(log_level)
+        self.log_level = log_level
+        self.queries = list(queries)
+        self.slice_pages = slice_pages
+        self.max_failures = max_failures
+        self.refresh_after = refresh_after
+        self.progress_path = progress_path
+        self.spider_kwargs = spider_kwargs
+        self.cond = threading.Condition()
+        self.order = { id(query): i for i, query in enumerate(self.queries) }
+        for query in self.queries:
+            query.open(restart)
+            if query.finished():
+                query.state = 'done'
+        drivers = drivers if drivers is not None else itertools.repeat(None)
+        self.sessions = [ Session(self, chromedriver_path, port, driver) for port, driver in zip(debug_ports, drivers) ]
+
+    def next_job(self):
+        with self.cond:
+            while True:
+                now = time.time()
+                waiting = [ query for query in self.queries if query.state == 'pending' and not query.running ]
+                if not waiting and not any(query.running for query in self.queries):
+                    return None
+                ready = []
+                wake_at = None
+                for query in waiting:
+                    pages = query.slice_pages(self.slice_pages)
+                    at = query.limiter.ready_at(pages)
+                    if at <= now:
+                        ready.append((-query.priority, query.slices, self.order[id(query)], query, pages))
+                    elif wake_at is None or at < wake_at:
+                        wake_at = at
+                if ready:
+                    *_, query, pages = min(ready, key=lambda job: job[:3])
+                    query.running = True
+                    query.limiter.take(pages)
+                    if query.started is None:
+                        query.started = time.time()
+                    return query, pages
+                self.cond.wait(None if wake_at is None else max(0.05, wake_at - now))
+
+    def release(self, query: Query, ok: bool):
+        with self.cond:
+            query.running = False
+            query.slices += 1
+            query.elapsed = time.time() - query.started
+            if query.finished():
+                query.state = 'done'
+            elif not ok:
+                query.failures += 1
+                if query.failures >= self.max_failures:
+                    query.state = 'failed'
+            else:
+                query.failures = 0
+            progress = query.progress()
+            self.cond.notify_all()
+        self.log.info("[.] %s: %s, page %s, %d posts, %d comments, %d slices, %.1fs" % (
+            progress['question'], progress['state'], progress['page'], progress['posts'], progress['comments'],
+            progress['slices'], progress['elapsed']))
+        self.save_progress()
+
+    def progress(self):
+        with self.cond:
+            return [ query.progress() for query in self.queries ]
+
+    def save_progress(self):
+        if self.progress_path is None:
+            return
+        tmp_path = str(self.progress_path) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({ 'updated': time.time(), 'queries': self.progress() }, f, ensure_ascii=False)
+        os.replace(tmp_path, Path(self.progress_path))
+
+    def run(self):
+        for session in self.sessions:
+            session.start()
+        for session in self.sessions:
+            session.join()
+        for query in self.queries:
+            query.close()
+        self.save_progress()
+        return self.progress()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queries', nargs='*', help="questions, crawled with the default priority and no page limit")
+    parser.add_argument('--file', default=None, help="query list, see load_queries")
+    parser.add_argument('--driver', default="chromedriver.exe")
+    parser.add_argument('--ports', type=int, nargs='+', default=[9222], help="debug ports of the browser sessions")
+    parser.add_argument('--slice-pages', type=int, default=2, help="pages crawled before the next query is scheduled")
+    parser.add_argument('--max-pages', type=int, default=None, help="default page limit per query")
+    parser.add_argument('--pages-per-minute', type=float, default=None, help="default page rate per query")
+    parser.add_argument('--restart', action='store_true', help="page every query from the start again")
+    parser.add_argument('--refresh-after', type=float, default=None,
+                        help="hours after which the comments of a harvested post are crawled again")
+    parser.add_argument('--progress', default=None, help="json file the per-query progress is written to")
+    args = parser.parse_args()
+
+    queries = load_queries(args.file) if args.file else []
+    queries += [ Query(question, max_pages=args.max_pages, pages_per_minute=args.pages_per_minute)
+                 for question in args.queries ]
+    if not queries:
+        parser.error("no queries")
+    refresh_after = args.refresh_after * 3600 if args.refresh_after is not None else None
+    scheduler = BatchScheduler(queries, args.driver, args.ports, args.slice_pages, restart=args.restart,
+                               refresh_after=refresh_after, progress_path=args.progress)
+    for progress in scheduler.run():
+        print("[+] %(question)s: %(state)s, %(posts)d posts, %(comments)d comments" % progress)
@@ -1,4 +1,5 @@
 from functools import wraps
+import threading
 
 def singleton(cls):
     _instance = {}
@@ -8,3 +9,26 @@ def singleton(cls):
             _instance[cls] = cls(*args, **kwargs)
         return _instance[cls]
     return get_instance
+
+def keyed_singleton(key, alive=lambda instance: True, config=None):
+    # one instance per key(*args, **kwargs), e.g. per database path, a dead instance is replaced.
+    # a live instance asked for with another config(*args, **kwargs) raises ValueError
+    def decorator(cls):
+        _instances = {}
+        _configs = {}
+        _lock = threading.Lock()
+        @wraps(cls)
+        def get_instance(*args, **kwargs):
+            k = key(*args, **kwargs)
+            c = config(*args, **kwargs) if config is not None else None
+            with _lock:
+                instance = _instances.get(k)
+                if instance is None or not alive(instance):
+                    instance = _instances[k] = cls(*args, **kwargs)
+                    _configs[k] = c
+                elif _configs[k] != c:
+                    raise ValueError("%s %s is already open with %r, not %r" % (cls.__name__, k, _configs[k], c))
+                return instance
+        get_instance.instances = _instances
+        return get_instance
+    return decorator
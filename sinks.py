@@ -0,0 +1,68 @@
+from datetime import datetime
+import json, sys
+
+
+def strtime(wb_time: str):
+    return datetime.strptime('20' + wb_time, "%Y-%m-%d %H:%M").strftime("%Y-%m-%d %H:%M")
+
+def feed_records(feed: dict):
+    # the rows a finished feed writes into WbData: users, messages and comments
+    comms = feed['comments']['comms']
+    users = [(feed['uid'], feed['nick_name'], feed['avator'])]
+    for comment in comms:
+        users.append((comment[0], comment[1], comment[2]))
+    messages = [(feed['mid'], feed['uid'], feed['top'], feed['from'], strtime(feed['time']), feed['content'])]
+    comments = [(feed['mid'], comment[0], strtime(comment[3]), comment[4]) for comment in comms]
+    return users, messages, comments
+
+def feed_json(feed: dict):
+    res = dict(feed)
+    if comments := feed.get('comments'):
+        res['comments'] = dict(comments, set=sorted(comments['set']))
+    return res
+
+
+class DbSink:
+
+    def __init__(self, db):
+        self.db = db
+
+    def write(self, feed: dict):
+        users, messages, comments = feed_records(feed)
+        self.db.insert_users(users)
+        self.db.insert_messages(messages)
+        self.db.insert_comments(comments)
+
+    def flush(self):
+        self.db.flush()
+
+    def close(self):
+        self.db.flush()
+
+
+class JsonlSink:
+
+    def __init__(self, path: str):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, feed: dict):
+        self.file.write(json.dumps(feed_json(feed), ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class StdoutSink:
+
+    def write(self, feed: dict):
+        print(json.dumps(feed_json(feed), ensure_ascii=False))
+        sys.stdout.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,51 @@
+from pathlib import Path
+import gzip, json, os
+
+
+class SnapshotArchive:
+    # raw page sources (and harvested scroller items) stored as gzip files for offline re-parsing
+
+    def __init__(self, directory: str, level: int=6):
+        self.directory = Path(directory)
+        self.level = level
+        (self.directory / 'search').mkdir(parents=True, exist_ok=True)
+        (self.directory / 'detail').mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def search_key(question: str, page: int):
+        return "%s_%04d" % (question.replace(' ', '_'), page)
+
+    def write(self, path: Path, data: bytes):
+        tmp_path = path.with_name(path.name + '.tmp')
+        with gzip.open(tmp_path, 'wb', compresslevel=self.level) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read(self, path: Path):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+
+    def save_search(self, question: str, page: int, source: str):
+        self.write(self.directory / 'search' / (self.search_key(question, page) + '.html.gz'), source.encode('utf-8'))
+
+    def save_detail(self, mid: str, source: str, items: list=None):
+        self.write(self.directory / 'detail' / (mid + '.html.gz'), source.encode('utf-8'))
+        if items is not None:
+            data = json.dumps(items, ensure_ascii=False).encode('utf-8')
+            self.write(self.directory / 'detail' / (mid + '.items.json.gz'), data)
+
+    def iter_search(self, question: str=None):
+        # the page number of search_key, so another question sharing the prefix does not match
+        prefix = question.replace(' ', '_') + '_' if question else '*_'
+        for path in sorted((self.directory / 'search').glob(prefix + '[0-9][0-9][0-9][0-9].html.gz')):
+            yield path.name[:-len('.html.gz')], self.read(path).decode('utf-8')
+
+    def load_detail(self, mid: str):
+        path = self.directory / 'detail' / (mid + '.html.gz')
+        if not path.exists():
+            return None, None
+        items = None
+        items_path = self.directory / 'detail' / (mid + '.items.json.gz')
+        if items_path.exists():
+            items = json.loads(self.read(items_path).decode('utf-8'))
+        return self.read(path).decode('utf-8'), items
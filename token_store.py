@@ -0,0 +1,97 @@
+from wb_data import WbData, open_cursor, doc_sources, read_watermark, write_watermark, iter_doc_chunks
+from tokenizer import default_stopwords, init_worker, tokenize_docs
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+import os
+
+
+class TokenStore:
+    # per document term counts in the corpus database, only rows past the watermark are tokenized
+
+    def __init__(self, db: WbData):
+        self.db = db
+        self.conn = db.wb_db
+        self.create_tables()
+
+    def create_tables(self):
+        with open_cursor(self.conn) as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS tf_message(mid char(16) NOT NULL, term varchar(64) NOT NULL, \
+                count integer NOT NULL, PRIMARY KEY(mid, term));")
+            cursor.execute("CREATE TABLE IF NOT EXISTS tf_comment(cid integer NOT NULL, term varchar(64) NOT NULL, \
+                count integer NOT NULL, PRIMARY KEY(cid, term));")
+            cursor.execute("CREATE TABLE IF NOT EXISTS tf_total(term varchar(64) PRIMARY KEY NOT NULL, count integer NOT NULL);")
+            cursor.execute("CREATE TABLE IF NOT EXISTS tf_watermark(source varchar(16) PRIMARY KEY NOT NULL, \
+                last_rowid integer NOT NULL);")
+            self.conn.commit()
+
+    def watermark(self, source: str):
+        with open_cursor(self.conn) as cursor:
+            return read_watermark(cursor, 'tf_watermark', source)
+
+    def chunks(self, source: str, chunk_size: int):
+        for rows in iter_doc_chunks(self.conn, source, self.watermark(source), chunk_size):
+            yield rows[-1][0], [ (ref, content) for _, ref, content in rows ]
+
+    def apply(self, source: str, last_rowid: int, docs: list):
+        # one transaction per chunk: document counts, aggregate counts and the watermark move together
+        table, key = ('tf_message', 'mid') if source == 'message' else ('tf_comment', 'cid')
+        total = Counter()
+        rows = []
+        for ref, counts in docs:
+            total.update(counts)
+            rows.extend((ref, term, count) for term, count in counts.items())
+        with self.conn:
+            with open_cursor(self.conn) as cursor:
+                cursor.executemany('INSERT or IGNORE INTO %s(%s, term, count) values(?, ?, ?);' % (table, key), rows)
+                cursor.executemany('INSERT INTO tf_total values(?, ?) \
+                    ON CONFLICT(term) DO UPDATE SET count = count + excluded.count;', total.items())
+                write_watermark(cursor, 'tf_watermark', source, last_rowid)
+
+    def update(self, chunk_size: int=2000, workers: int=None, stopwords: frozenset=default_stopwords):
+        updated = 0
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(stopwords,)) as pool:
+            for source in doc_sources:
+                pending = []
+                for last_rowid, docs in self.chunks(source, chunk_size):
+                    pending.append((last_rowid, len(docs), pool.submit(tokenize_docs, docs)))
+                    if len(pending) >= 2 * workers:
+                        last_rowid, count, future = pending.pop(0)
+                        self.apply(source, last_rowid, future.result())
+                        updated += count
+                for last_rowid, count, future in pending:
+                    self.apply(source, last_rowid, future.result())
+                    updated += count
+        return updated
+
+    @staticmethod
+    def query(start: str=None, end: str=None, mids: list=None, skip_dups: bool=False):
+        # (sql, params) of the term counts, most frequent first, skip_dups leaves out near duplicates
+        if start is None and end is None and not mids and not skip_dups:
+            return 'SELECT term, count FROM tf_total ORDER BY count DESC, term DESC;', []
+
+        conds, params = [], []
+        if start is not None:
+            conds.append('d.time >= ?')
+            params.append(start)
+        if end is not None:
+            conds.append('d.time < ?')
+            params.append(end)
+        if mids:
+            conds.append('d.mid IN (%s)' % ', '.join('?' * len(mids)))
+            params.extend(mids)
+        if skip_dups:
+            conds.append('d.dup_of IS NULL')
+        where = ' AND '.join(conds)
+        sql = 'SELECT term, SUM(count) AS total FROM (\
+            SELECT t.term, t.count FROM tf_message t JOIN message d ON d.mid = t.mid WHERE %s \
+            UNION ALL \
+            SELECT t.term, t.count FROM tf_comment t JOIN comment d ON d.rowid = t.cid WHERE %s \
+            ) GROUP BY term ORDER BY total DESC, term DESC;' % (where, where)
+        return sql, params + params
+
+    def frequencies(self, start: str=None, end: str=None, mids: list=None, skip_dups: bool=False):
+        sql, params = self.query(start, end, mids, skip_dups)
+        with open_cursor(self.conn) as cursor:
+            cursor.execute(sql, params)
+            return Counter(dict(cursor.fetchall()))
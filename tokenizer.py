@@ -0,0 +1,36 @@
+from collections import Counter
+import re
+import jieba
+
+word_pattern = re.compile(r"\w+")
+default_stopwords = frozenset([
+    '我们', '你们', '他们', '她们', '自己', '什么', '这个', '那个', '这样', '那样', '因为', '所以', '但是', '然后',
+    '如果', '就是', '还是', '不是', '没有', '可以', '已经', '一个', '现在', '这些', '那些', '时候', '还有', '而且',
+    '转发', '微博', '回复', '展开', '全文', '网页', '链接', '视频'
+])
+_stopwords = default_stopwords
+
+
+def load_stopwords(path: str=None):
+    if path is None:
+        return default_stopwords
+    with open(path, 'r', encoding='utf-8') as f:
+        return default_stopwords | { line.strip() for line in f if line.strip() }
+
+def init_worker(stopwords: frozenset):
+    global _stopwords
+    _stopwords = stopwords
+
+def words(content: str, stopwords: frozenset=None):
+    stopwords = _stopwords if stopwords is None else stopwords
+    return [ s for s in jieba.lcut(content) if len(s) > 1 and word_pattern.match(s) and s not in stopwords ]
+
+def tokenize(contents: list, stopwords: frozenset=None):
+    counts = Counter()
+    for content in contents:
+        counts.update(words(content, stopwords))
+    return counts
+
+def tokenize_docs(docs: list, stopwords: frozenset=None):
+    # [(ref, content)] -> [(ref, Counter)]
+    return [ (ref, Counter(words(content, stopwords))) for ref, content in docs if content ]
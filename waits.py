@@ -0,0 +1,117 @@
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
+import time
+
+
+def new_window(handles):
+    handles = set(handles)
+    def condition(driver):
+        for handle in driver.window_handles:
+            if handle not in handles:
+                return handle
+        return False
+    return condition
+
+def document_ready(driver):
+    return driver.execute_script('return document.readyState;') == 'complete'
+
+def count_changed(script: str, count: int):
+    # script returns a number, e.g. the rendered scroller items
+    def condition(driver):
+        current = driver.execute_script(script)
+        return current if current != count else False
+    return condition
+
+def network_idle(quiet: float=0.5):
+    # no new resource entries and a complete document for `quiet` seconds
+    state = { 'count': -1, 'since': time.time() }
+    def condition(driver):
+        ready, count = driver.execute_script(
+            "return [document.readyState, performance.getEntriesByType('resource').length];")
+        now = time.time()
+        if ready != 'complete' or count != state['count']:
+            state['count'] = count
+            state['since'] = now
+            return False
+        return now - state['since'] >= quiet
+    return condition
+
+
+class Waiter:
+
+    def __init__(self, driver, alpha: float=0.3, min_poll: float=0.05, max_poll: float=0.5):
+        self.driver = driver
+        self.alpha = alpha
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.latency = dict()
+        self.stats = dict()
+
+    def observe(self, name: str, elapsed: float):
+        if name in self.latency:
+            self.latency[name] += self.alpha * (elapsed - self.latency[name])
+        else:
+            self.latency[name] = elapsed
+
+    def record(self, name: str, elapsed: float, timeout: bool):
+        stat = self.stats.setdefault(name, { 'count': 0, 'total': 0.0, 'max': 0.0, 'timeouts': 0 })
+        stat['count'] += 1
+        stat['total'] += elapsed
+        stat['max'] = max(stat['max'], elapsed)
+        if timeout:
+            stat['timeouts'] += 1
+        else:
+            self.observe(name, elapsed)
+
+    def poll(self, name: str):
+        # poll faster for waits that usually resolve quickly
+        if name not in self.latency:
+            return self.min_poll * 4
+        return min(self.max_poll, max(self.min_poll, self.latency[name] / 10))
+
+    def until(self, name: str, condition, timeout: float):
+        start = time.time()
+        try:
+            res = WebDriverWait(self.driver, timeout, poll_frequency=self.poll(name),
+                                ignored_exceptions=(NoSuchElementException, StaleElementReferenceException)
+                                ).until(condition)
+        except TimeoutException:
+            self.record(name, time.time() - start, True)
+            raise
+        else:
+            self.record(name, time.time() - start, False)
+            return res
+
+    def attempt(self, name: str, condition, timeout: float):
+        try:
+            return self.until(name, condition, timeout)
+        except TimeoutException:
+            return False
+
+    def report(self):
+        return {
+            name: dict(stat, mean=stat['total'] / stat['count'] if stat['count'] else 0.0)
+            for name, stat in sorted(self.stats.items(), key=lambda kv: -kv[1]['total'])
+        }
+
+
+class Backoff:
+    # stall thresholds of the comment scroller, tuned from the observed gaps between new comments
+
+    def __init__(self, waiter: Waiter, name: str, factor: float=8, min_delay: float=10, max_delay: float=60):
+        self.waiter = waiter
+        self.name = name
+        self.factor = factor
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.last = time.time()
+
+    def progress(self):
+        now = time.time()
+        self.waiter.observe(self.name, now - self.last)
+        self.last = now
+
+    def delay(self):
+        if self.name not in self.waiter.latency:
+            return self.max_delay
+        return min(self.max_delay, max(self.min_delay, self.factor * self.waiter.latency[self.name]))
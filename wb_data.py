@@ -1,7 +1,7 @@
 from pathlib import Path
 from contextlib import contextmanager
-from singleton import singleton
-import sqlite3
+from singleton import keyed_singleton
+import sqlite3, queue, threading, time, hashlib, inspect
 
 @contextmanager
 def open_cursor(conn: sqlite3.Connection):
@@ -14,43 +14,371 @@ def open_cursor(conn: sqlite3.Connection):
     else:
         cursor.close()
 
-@singleton
+def tune(conn: sqlite3.Connection):
+    with open_cursor(conn) as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL;')
+        cursor.execute('PRAGMA synchronous=NORMAL;')
+        cursor.execute('PRAGMA temp_store=MEMORY;')
+        cursor.execute('PRAGMA cache_size=-16000;')
+
+def content_hash(content: str):
+    return hashlib.sha1((content or '').encode('utf-8')).hexdigest()
+
+# the trigram tokenizer came with sqlite 3.34, older builds search with LIKE only
+fts_available = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+def fts_phrase(keyword: str):
+    return '"%s"' % keyword.replace('"', '""')
+
+def content_filter(table: str, keyword: str=None, start: str=None, end: str=None, mids: list=None,
+                   uids: list=None, skip_dups: bool=False, fts: bool=True):
+    # -> (join, conds, params) over `table t`, keywords of 3+ characters go through the trigram index
+    join, conds, params = '', [], []
+    if keyword and len(keyword) >= 3 and fts:
+        join = ' JOIN %s_fts f ON f.rowid = t.rowid' % table
+        conds.append('%s_fts MATCH ?' % table)
+        params.append(fts_phrase(keyword))
+    elif keyword:
+        conds.append('t.content LIKE ?')
+        params.append('%' + keyword + '%')
+    if start is not None:
+        conds.append('t.time >= ?')
+        params.append(start)
+    if end is not None:
+        conds.append('t.time < ?')
+        params.append(end)
+    if mids:
+        conds.append('t.mid IN (%s)' % ', '.join('?' * len(mids)))
+        params.extend(mids)
+    if uids:
+        conds.append('t.uid IN (%s)' % ', '.join('?' * len(uids)))
+        params.extend(uids)
+    if skip_dups:
+        conds.append('t.dup_of IS NULL')
+    return join, conds, params
+
+# the texts of the corpus tables in insert order as (rowid, ref, content), ref is the mid or the comment rowid.
+# derived tables (token counts, near duplicates) keep the last rowid they consumed per source as a watermark
+doc_sources = {
+    'message': 'SELECT rowid, mid, content FROM message WHERE rowid > ? ORDER BY rowid LIMIT ?;',
+    'comment': 'SELECT rowid, rowid, content FROM comment WHERE rowid > ? ORDER BY rowid LIMIT ?;',
+}
+
+def read_watermark(cursor: sqlite3.Cursor, table: str, source: str):
+    cursor.execute('SELECT last_rowid FROM %s WHERE source = ?;' % table, (source,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def write_watermark(cursor: sqlite3.Cursor, table: str, source: str, last_rowid: int, *extra):
+    cursor.execute('INSERT or REPLACE INTO %s values(%s);' % (table, ', '.join('?' * (2 + len(extra)))),
+                   (source, last_rowid) + extra)
+
+def iter_doc_chunks(conn: sqlite3.Connection, source: str, last_rowid: int, chunk_size: int):
+    while True:
+        with open_cursor(conn) as cursor:
+            cursor.execute(doc_sources[source], (last_rowid, chunk_size))
+            rows = cursor.fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        yield rows
+
+class WbWriter(threading.Thread):
+    # writes the queued rows on its own pooled connections, one transaction per flush
+
+    def __init__(self, pool, batch_size: int=500, flush_interval: float=1.0, queue_size: int=10000,
+                 max_retries: int=5):
+        super().__init__(name="wb-writer", daemon=True)
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = {}
+        self.pending_rows = 0
+        # failed batches as [db, batches, attempts, retry_at], set aside so the new rows keep being written
+        self.retries = []
+        self.max_retries = max_retries
+        # the error of a batch given up since the last flush
+        self.error = None
+        self.metrics = None
+        self.near_dup = None
+
+    @staticmethod
+    def count_rows(batches: dict):
+        return sum(len(rows) for rows in batches.values())
+
+    def unwritten(self):
+        return self.pending_rows + sum(self.count_rows(batches) for _, batches, _, _ in self.retries)
+
+    def put(self, db: str, sql: str, rows: list):
+        if rows:
+            if not self.is_alive():
+                raise RuntimeError("wb-writer is not running, %d rows not queued" % len(rows))
+            self.queue.put((db, sql, rows))
+
+    def request(self, command: str):
+        # the error of the write the command triggered or of a batch given up before it
+        done = threading.Event()
+        done.error = None
+        self.queue.put((command, None, done))
+        while not done.wait(0.5):
+            if not self.is_alive():
+                raise RuntimeError("wb-writer stopped, %d rows not written" % self.unwritten())
+        return done.error
+
+    def flush(self):
+        if (error := self.request('flush')) is not None:
+            raise error
+
+    def stop(self):
+        error = self.request('stop') if self.is_alive() else None
+        self.join()
+        if error is not None or self.unwritten():
+            print("[-] wb-writer stopped, %d rows not written: " % self.unwritten(), str(error))
+
+    def write(self, conns: dict, force: bool=False):
+        if self.metrics is not None and (self.pending or self.retries):
+            with self.metrics.stage('db_flush'):
+                return self.write_pending(conns, force)
+        return self.write_pending(conns, force)
+
+    def write_batches(self, conn: sqlite3.Connection, db: str, batches: dict):
+        try:
+            with conn:
+                with open_cursor(conn) as cursor:
+                    for sql, rows in batches.items():
+                        cursor.executemany(sql, rows)
+                if db == 'wb' and self.near_dup is not None:
+                    self.near_dup.update(conn)
+        except Exception as e:
+            return e
+        return None
+
+    def write_pending(self, conns: dict, force: bool=False):
+        # a failed batch is set aside and tried again with a growing delay, a flush tries it at once.
+        # after max_retries attempts its rows are dropped and the next flush raises the error
+        error = None
+        now = time.time()
+        for retry in list(self.retries):
+            db, batches, attempts, retry_at = retry
+            if retry_at > now and not force:
+                continue
+            if (e := self.write_batches(conns[db], db, batches)) is None:
+                self.retries.remove(retry)
+                continue
+            error = e
+            if attempts >= self.max_retries:
+                print("[-] write %s rows failed %d times, %d rows dropped: " % (db, attempts, self.count_rows(batches)),
+                      str(e))
+                self.retries.remove(retry)
+                self.error = e
+            else:
+                retry[2] = attempts + 1
+                retry[3] = now + self.flush_interval * 2 ** attempts
+        for db in list(self.pending):
+            batches = self.pending.pop(db)
+            if (e := self.write_batches(conns[db], db, batches)) is not None:
+                print("[-] write %s rows error, set aside for retry: " % db, str(e))
+                self.retries.append([db, batches, 1, now + self.flush_interval])
+                error = e
+        self.pending_rows = 0
+        if force:
+            error, self.error = error or self.error, None
+        return error
+
+    def run(self):
+        done = None
+        try:
+            conns = { 'user': self.pool.connection('user'), 'wb': self.pool.connection('wb') }
+            last_flush = time.time()
+            while True:
+                try:
+                    db, sql, rows = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    db = None
+                if db in ('flush', 'stop'):
+                    done = rows
+                    done.error = self.write(conns, force=True)
+                    last_flush = time.time()
+                    done.set()
+                    done = None
+                    if db == 'stop':
+                        break
+                    continue
+                if db is not None:
+                    self.pending.setdefault(db, {}).setdefault(sql, []).extend(rows)
+                    self.pending_rows += len(rows)
+                if self.pending_rows >= self.batch_size or time.time() - last_flush >= self.flush_interval:
+                    self.write(conns)
+                    last_flush = time.time()
+        except Exception as e:
+            print("[-] wb-writer failed, %d rows not written: " % self.unwritten(), str(e))
+            if done is not None:
+                done.error = e
+        finally:
+            # nobody waits forever on a flush or stop
+            if done is not None:
+                done.set()
+            while True:
+                try:
+                    db, _, rows = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if db in ('flush', 'stop'):
+                    rows.error = RuntimeError("wb-writer stopped")
+                    rows.set()
+            self.pool.release()
+
+class ConnectionPool:
+    # one connection per thread and database, sqlite3 connections must not be shared between threads.
+    # unified keeps one connection per thread on the corpus db with the user db attached as `users`
+
+    def __init__(self, user_path: str, wb_path: str, unified: bool=False, timeout: float=30):
+        self.user_path = user_path
+        self.wb_path = wb_path
+        self.unified = unified
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.conns = set()
+
+    @property
+    def attached(self):
+        return self.unified and Path(self.user_path).resolve() != Path(self.wb_path).resolve()
+
+    def open(self, db: str):
+        # check_same_thread is off only so close() can close every thread's connection on shutdown,
+        # a connection is otherwise used by the thread that opened it
+        conn = sqlite3.connect(self.user_path if db == 'user' else self.wb_path, timeout=self.timeout,
+                               check_same_thread=False)
+        tune(conn)
+        if db == 'wb' and self.attached:
+            conn.execute('ATTACH DATABASE ? AS users;', (str(self.user_path),))
+        with self.lock:
+            self.conns.add(conn)
+        return conn
+
+    def connection(self, db: str='wb'):
+        if self.unified:
+            db = 'wb'
+        conns = getattr(self.local, 'conns', None)
+        if conns is None:
+            conns = self.local.conns = {}
+        if db not in conns:
+            conns[db] = self.open(db)
+        return conns[db]
+
+    def release(self):
+        # closes the connections of the calling thread
+        conns = getattr(self.local, 'conns', None) or {}
+        for conn in conns.values():
+            with self.lock:
+                self.conns.discard(conn)
+            conn.close()
+        self.local.conns = {}
+
+    def close(self):
+        self.release()
+        with self.lock:
+            conns, self.conns = self.conns, set()
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print("[-] close sqlite3 connection error: ", str(e))
+
+def db_key(user_path: str="user.db", wb_path: str="wb.db", *args, **kwargs):
+    return (str(Path(user_path).resolve()), str(Path(wb_path).resolve()))
+
+def db_config(*args, **kwargs):
+    # everything but the paths, whoever opens a database again shares the writer and layout of the first
+    bound = inspect.signature(WbData).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return tuple((name, value) for name, value in bound.arguments.items() if name not in ('user_path', 'wb_path'))
+
+@keyed_singleton(db_key, alive=lambda db: db.connected, config=db_config)
 class WbData:
+    schema_version = 2
 
-    def __init__(self, user_path: str="user.db", wb_path: str="wb.db"):
+    def __init__(self, user_path: str="user.db", wb_path: str="wb.db", write_behind: bool=False,
+                 batch_size: int=500, flush_interval: float=1.0, queue_size: int=10000, unified: bool=False,
+                 near_dup=None):
         self.user_path = user_path
         self.wb_path = wb_path
         self.connected = False
-        self.user_db = None
-        self.wb_db = None
-        self.user_created = Path(user_path).exists()
+        self.pool = ConnectionPool(user_path, wb_path, unified)
+        self.writer = None
+        self.metrics = None
+        self.fts = False
+        # a near_dup.NearDupIndex tags near duplicated posts and comments with dup_of as they are written
+        self.near_dup = near_dup
+        self.write_behind = write_behind
+        self.writer_args = (batch_size, flush_interval, queue_size)
         self.wb_created = Path(wb_path).exists()
         self.connect()
 
+    @property
+    def wb_db(self):
+        return self.pool.connection('wb')
+
+    @property
+    def user_db(self):
+        return self.pool.connection('user')
+
+    @property
+    def user_table(self):
+        return 'users.user' if self.pool.attached else 'user'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        if self.writer is not None:
+            self.writer.metrics = metrics
+
     def close(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
         if self.connected:
-            self.wb_db.close()
-            self.user_db.close()
+            self.pool.close()
             self.connected = False
 
     def connect(self):
         if not self.connected:
             try:
-                self.wb_db = sqlite3.connect(self.wb_path)
-                self.user_db = sqlite3.connect(self.user_path)
+                self.wb_db
+                self.user_db
             except Exception as e:
                 print("[-] connect sqlite3 error: ", str(e))
                 return False
             else:
                 self.connected = True
-                if not self.user_created:
-                    self.create_user_table()
+                self.create_user_table()
                 if not self.wb_created:
                     self.create_wbmsg_table()
+                else:
+                    self.migrate()
+                self.fts = self.check_fts()
+                if self.near_dup is not None:
+                    self.near_dup.create_tables(self.wb_db)
+                if self.write_behind:
+                    self.writer = WbWriter(self.pool, *self.writer_args)
+                    self.writer.near_dup = self.near_dup
+                    self.writer.start()
         return True
 
     def create_user_table(self):
-        sql = "CREATE TABLE user(uid char(10) PRIMARY KEY NOT NULL, nick varchar(300), avator varchar(300));"
+        sql = "CREATE TABLE IF NOT EXISTS %s(uid char(10) PRIMARY KEY NOT NULL, nick varchar(300), avator varchar(300));" \
+            % self.user_table
         with open_cursor(self.user_db) as cursor:
             cursor.execute(sql)
             self.user_db.commit()
@@ -58,40 +386,208 @@ class WbData:
     def create_wbmsg_table(self):
         msg_sql = "CREATE TABLE message(\
             mid char(16) PRIMARY KEY NOT NULL, uid char(10) NOT NULL, top varchar(100), \
-                client varchar(128), time date NOT NULL, content text);"
+                client varchar(128), time date NOT NULL, content text, dup_of char(16));"
         comment_sql = "CREATE TABLE comment(mid char(16) NOT NULL, uid char(10) NOT NULL, \
-                time date, content text);"
+                time date, content text, chash char(40), dup_of integer);"
         with open_cursor(self.wb_db) as cursor:
             cursor.execute(msg_sql)
             cursor.execute(comment_sql)
+            self.create_indexes(cursor)
+            cursor.execute('PRAGMA user_version=%d;' % self.schema_version)
             self.wb_db.commit()
+
+    def create_indexes(self, cursor: sqlite3.Cursor):
+        # the unique key leads with mid, so it also serves the per-post comment lookups
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS comment_key ON comment(mid, uid, time, chash);')
+        cursor.execute('CREATE INDEX IF NOT EXISTS comment_uid ON comment(uid);')
+        cursor.execute('CREATE INDEX IF NOT EXISTS message_time ON message(time);')
+        if fts_available:
+            self.create_fts(cursor)
+
+    def create_fts(self, cursor: sqlite3.Cursor):
+        for table in ('message', 'comment'):
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s_fts USING fts5(\
+                content, content='%s', content_rowid='rowid', tokenize='trigram');" % (table, table))
+            cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_fts_ai AFTER INSERT ON %s BEGIN \
+                INSERT INTO %s_fts(rowid, content) VALUES (new.rowid, new.content); END;" % (table, table, table))
+            cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_fts_ad AFTER DELETE ON %s BEGIN \
+                INSERT INTO %s_fts(%s_fts, rowid, content) VALUES ('delete', old.rowid, old.content); END;"
+                % (table, table, table, table))
+            cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_fts_au AFTER UPDATE OF content ON %s BEGIN \
+                INSERT INTO %s_fts(%s_fts, rowid, content) VALUES ('delete', old.rowid, old.content); \
+                INSERT INTO %s_fts(rowid, content) VALUES (new.rowid, new.content); END;"
+                % (table, table, table, table, table))
+
+    def check_fts(self):
+        # a corpus created by an older sqlite gets its index once the tokenizer is there
+        if not fts_available:
+            return False
+        with open_cursor(self.wb_db) as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN ('message_fts', 'comment_fts');")
+            if cursor.fetchone()[0] == 2:
+                return True
+            print("[.] build the full text index of %s" % self.wb_path)
+            with self.wb_db:
+                self.create_fts(cursor)
+                cursor.execute("INSERT INTO message_fts(message_fts) VALUES ('rebuild');")
+                cursor.execute("INSERT INTO comment_fts(comment_fts) VALUES ('rebuild');")
+        return True
+
+    def migrate(self):
+        with open_cursor(self.wb_db) as cursor:
+            cursor.execute('PRAGMA user_version;')
+            version = cursor.fetchone()[0]
+            if version >= self.schema_version:
+                return False
+            print("[.] migrate %s from schema version %d to %d" % (self.wb_path, version, self.schema_version))
+            if version < 1:
+                self.migrate_v1(cursor)
+            if version < 2:
+                # dup_of of near duplicated posts and comments, see near_dup.NearDupIndex
+                with self.wb_db:
+                    for table, column in (('message', 'dup_of char(16)'), ('comment', 'dup_of integer')):
+                        cursor.execute('PRAGMA table_info(%s);' % table)
+                        if 'dup_of' not in [ row[1] for row in cursor.fetchall() ]:
+                            cursor.execute('ALTER TABLE %s ADD COLUMN %s;' % (table, column))
+                    cursor.execute('PRAGMA user_version=2;')
+            return True
+
+    def migrate_v1(self, cursor: sqlite3.Cursor):
+        self.wb_db.create_function('content_hash', 1, content_hash, deterministic=True)
+        with self.wb_db:
+            cursor.execute('PRAGMA table_info(comment);')
+            if 'chash' not in [ row[1] for row in cursor.fetchall() ]:
+                cursor.execute('ALTER TABLE comment ADD COLUMN chash char(40);')
+            cursor.execute('UPDATE comment SET chash = content_hash(content) WHERE chash IS NULL;')
+            cursor.execute('DELETE FROM comment WHERE rowid NOT IN (\
+                SELECT MIN(rowid) FROM comment GROUP BY mid, uid, time, chash);')
+            removed = cursor.rowcount
+            self.create_indexes(cursor)
+            if fts_available:
+                cursor.execute("INSERT INTO message_fts(message_fts) VALUES ('rebuild');")
+                cursor.execute("INSERT INTO comment_fts(comment_fts) VALUES ('rebuild');")
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'tf_comment';")
+            if removed > 0 and cursor.fetchone():
+                # drop the token counts of the removed duplicates, see token_store.TokenStore
+                cursor.execute('DELETE FROM tf_comment WHERE cid NOT IN (SELECT rowid FROM comment);')
+                cursor.execute('DELETE FROM tf_total;')
+                cursor.execute('INSERT INTO tf_total SELECT term, SUM(count) FROM (\
+                    SELECT term, count FROM tf_message UNION ALL SELECT term, count FROM tf_comment) GROUP BY term;')
+            cursor.execute('PRAGMA user_version=1;')
+        print("[+] removed %d duplicated comments" % max(removed, 0))
     
+    def insert_rows(self, db: str, sql: str, rows: list):
+        if self.writer is not None:
+            self.writer.put(db, sql, rows)
+            return
+        conn = self.user_db if db == 'user' else self.wb_db
+        start = time.perf_counter()
+        with open_cursor(conn) as cursor:
+            cursor.executemany(sql, rows)
+            if db == 'wb' and self.near_dup is not None:
+                self.near_dup.update(conn)
+            conn.commit()
+        if self.metrics is not None:
+            self.metrics.add_stage('db_commit', time.perf_counter() - start)
+
     def insert_users(self, users: list):
-        sql = 'INSERT or IGNORE INTO user values(?, ?, ?);'
-        with open_cursor(self.user_db) as cursor:
-            for uid, nick_name, avator in users:
-                cursor.execute(sql, (uid, nick_name, avator))
-            self.user_db.commit()
+        sql = 'INSERT or IGNORE INTO %s values(?, ?, ?);' % self.user_table
+        self.insert_rows('user', sql, [(uid, nick_name, avator) for uid, nick_name, avator in users])
 
     def insert_messages(self, messages: list):
-        sql = 'INSERT or IGNORE INTO message values(?, ?, ?, ?, ?, ?);'
-        with open_cursor(self.wb_db) as cursor:
-            for mid, uid, top, sfrom, stime, content in messages:
-                cursor.execute(sql, (mid, uid, top, sfrom, stime, content))
-            self.wb_db.commit()
+        sql = 'INSERT or IGNORE INTO message(mid, uid, top, client, time, content) values(?, ?, ?, ?, ?, ?);'
+        self.insert_rows('wb', sql, [
+            (mid, uid, top, sfrom, stime, content) for mid, uid, top, sfrom, stime, content in messages
+        ])
     
     def insert_comments(self, comments: list):
-        sql = 'INSERT or IGNORE INTO comment values(?, ?, ?, ?);'
-        with open_cursor(self.wb_db) as cursor:
-            for mid, uid, stime, content in comments:
-                cursor.execute(sql, (mid, uid, stime, content))
-            self.wb_db.commit()
+        sql = 'INSERT or IGNORE INTO comment(mid, uid, time, content, chash) values(?, ?, ?, ?, ?);'
+        self.insert_rows('wb', sql, [
+            (mid, uid, stime, content, content_hash(content)) for mid, uid, stime, content in comments
+        ])
 
     def select_wb_tables(self, sql):
         with open_cursor(self.wb_db) as cursor:
             cursor.execute(sql)
             return cursor.fetchall()
 
+    def select_known_mids(self, mids: list):
+        if not mids:
+            return set()
+        sql = 'SELECT mid FROM message WHERE mid IN (%s);' % ', '.join('?' * len(mids))
+        with open_cursor(self.wb_db) as cursor:
+            cursor.execute(sql, list(mids))
+            return { row[0] for row in cursor.fetchall() }
+
+    def search(self, table: str, keyword: str=None, start: str=None, end: str=None, mid: str=None,
+               limit: int=100):
+        # keyword search over the trigram index, shorter keywords or no index fall back to LIKE
+        if table == 'message':
+            columns = 't.mid, t.uid, t.top, t.client, t.time, t.content'
+        else:
+            columns = 't.mid, t.uid, t.time, t.content'
+        join, conds, params = content_filter(table, keyword, start, end, [mid] if mid is not None else None,
+                                             fts=self.fts)
+        sql = 'SELECT %s FROM %s t%s' % (columns, table, join)
+        if conds:
+            sql += ' WHERE ' + ' AND '.join(conds)
+        sql += ' ORDER BY t.time'
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        with open_cursor(self.wb_db) as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def search_messages(self, keyword: str=None, start: str=None, end: str=None, limit: int=100):
+        return self.search('message', keyword, start, end, None, limit)
+
+    def search_comments(self, keyword: str=None, start: str=None, end: str=None, mid: str=None, limit: int=100):
+        return self.search('comment', keyword, start, end, mid, limit)
+
+    def select_comment_users(self, mid: str=None, limit: int=100):
+        # comments with their authors, one join in the unified layout, a second lookup otherwise
+        sql = 'SELECT c.mid, c.uid, u.nick, u.avator, c.time, c.content FROM comment c LEFT JOIN %s u ON u.uid = c.uid' \
+            % self.user_table
+        if not self.pool.unified:
+            sql = 'SELECT c.mid, c.uid, NULL, NULL, c.time, c.content FROM comment c'
+        params = []
+        if mid is not None:
+            sql += ' WHERE c.mid = ?'
+            params.append(mid)
+        sql += ' ORDER BY c.time'
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        with open_cursor(self.wb_db) as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if self.pool.unified or not rows:
+            return rows
+        uids = list({ row[1] for row in rows })
+        users = {}
+        with open_cursor(self.user_db) as cursor:
+            for i in range(0, len(uids), 500):
+                part = uids[i:i + 500]
+                cursor.execute('SELECT uid, nick, avator FROM user WHERE uid IN (%s);' % ', '.join('?' * len(part)), part)
+                users.update({ uid: (nick, avator) for uid, nick, avator in cursor.fetchall() })
+        return [ (mid, uid) + users.get(uid, (None, None)) + (stime, content) for mid, uid, _, _, stime, content in rows ]
+
+    def iter_rows(self, sql: str, params: list=(), chunk_size: int=5000, db: str='wb'):
+        # chunks of rows straight from the cursor
+        conn = self.user_db if db == 'user' else self.wb_db
+        with open_cursor(conn) as cursor:
+            cursor.execute(sql, params)
+            while rows := cursor.fetchmany(chunk_size):
+                yield rows
+
+    def iter_contents(self, chunk_size: int=2000, skip_dups: bool=False):
+        # message then comment contents, chunk by chunk without loading the whole corpus
+        where = ' WHERE dup_of IS NULL' if skip_dups else ''
+        for sql in ('SELECT content FROM message%s;' % where, 'SELECT content FROM comment%s;' % where):
+            with open_cursor(self.wb_db) as cursor:
+                cursor.execute(sql)
+                while rows := cursor.fetchmany(chunk_size):
+                    yield [ row[0] for row in rows if row[0] ]
+
     def select_contents(self):
         sql1 = 'SELECT content FROM message;'
         sql2 = 'SELECT content FROM comment;'
@@ -0,0 +1,117 @@
+# javascript snippets injected into the weibo pages through execute_script
+
+EXTRACT_CARDS = r"""
+const text = (elem) => elem ? elem.innerText.trim() : null;
+const cards = [];
+const items = document.evaluate('//div[@action-type="feed_list_item"]', document, null,
+    XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+for (let i = 0; i < items.snapshotLength; i++) {
+    const item = items.snapshotItem(i);
+    const mid = item.getAttribute('mid');
+    if (mid === null) {
+        continue;
+    }
+    const top = item.querySelector('.card-top');
+    const card = item.querySelector('.card');
+    const feed = card ? card.querySelector('.card-feed') : null;
+    const res = {
+        mid: mid, top: top ? text(top) : '', has_card: card !== null, feed: feed,
+        user_link: null, avator: null, nick_name: null, from: null, link: null, link_elem: null,
+        has_avator: false, has_from: false
+    };
+    if (feed) {
+        const avator = feed.querySelector('.avator');
+        if (avator) {
+            res.has_avator = true;
+            const user_link = avator.querySelector('a');
+            const img = avator.querySelector('img');
+            res.user_link = user_link ? user_link.href : null;
+            res.avator = img ? img.src : null;
+        }
+        const name = feed.querySelector('.name');
+        res.nick_name = name ? name.getAttribute('nick-name') : null;
+        const from = feed.querySelector('.from');
+        if (from) {
+            res.has_from = true;
+            const links = from.querySelectorAll('a');
+            res.from = links.length > 1 ? text(links[links.length - 1]) : '';
+            if (links.length > 0) {
+                res.link = links[0].href;
+                res.link_elem = links[0];
+            }
+        }
+    }
+    cards.push(res);
+}
+return cards;
+"""
+
+# arguments: scroll interval in ms, scroll step in px
+COMMENT_OBSERVER = r"""
+if (window.__wbComments) {
+    return false;
+}
+const state = { buffer: [], seen: new Set(), observer: null, timer: null, scheduled: false };
+const collect = () => {
+    state.scheduled = false;
+    for (const item of document.querySelectorAll('.vue-recycle-scroller__item-view')) {
+        const scroller = item.querySelector('.wbpro-scroller-item');
+        if (!scroller) {
+            continue;
+        }
+        const text = item.innerText;
+        const index = scroller.getAttribute('data-index');
+        const key = index + '\u0001' + text;
+        if (state.seen.has(key)) {
+            continue;
+        }
+        state.seen.add(key);
+        const link = scroller.querySelector('a');
+        const avator = item.querySelector('.woo-avatar-img');
+        state.buffer.push({
+            index: index, text: text,
+            href: link ? link.href : null, avator: avator ? avator.src : null
+        });
+    }
+};
+state.observer = new MutationObserver(() => {
+    if (!state.scheduled) {
+        state.scheduled = true;
+        window.requestAnimationFrame(collect);
+    }
+});
+state.observer.observe(document.body, { childList: true, subtree: true, characterData: true });
+state.timer = window.setInterval(() => window.scrollBy(0, arguments[1]), arguments[0]);
+window.__wbComments = state;
+collect();
+return true;
+"""
+
+DRAIN_COMMENTS = r"""
+const state = window.__wbComments;
+if (!state) {
+    return null;
+}
+const bottom = document.evaluate("//div[starts-with(@class, 'Bottom_text_')]", document, null,
+    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+const tips = Array.from(document.querySelectorAll('span.woo-tip-text'), (e) => e.innerText);
+return {
+    items: state.buffer.splice(0, state.buffer.length),
+    bottom: bottom ? bottom.innerText : null,
+    tips: tips,
+    rendered: document.querySelectorAll('.vue-recycle-scroller__item-view').length
+};
+"""
+
+COMMENTS_BUFFERED = r"""
+return window.__wbComments ? window.__wbComments.buffer.length : -1;
+"""
+
+STOP_COMMENT_OBSERVER = r"""
+const state = window.__wbComments;
+if (state) {
+    state.observer.disconnect();
+    window.clearInterval(state.timer);
+    delete window.__wbComments;
+}
+"""
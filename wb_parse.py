@@ -0,0 +1,31 @@
+# extraction helpers shared by the live spider and the offline parser
+import re
+
+comment_pattern = re.compile(r"(.*)\s?:(.*)\s((?:\d{,2}\-?){3}\s?(?:\d{1,2}:\d{1,2}))\s?")
+uid_pattern = re.compile(r"/u/(\d+)")
+user_link_pattern = re.compile(r'https://weibo.com/(\d+)?.*')
+
+
+def parse_user_link(user_link: str):
+    if matched := user_link_pattern.findall(user_link):
+        return matched[0]
+    return None
+
+def parse_comment_item(item: dict, comments: dict, comments_set: set):
+    # item holds the rendered text, data-index, user link and avatar of one scroller item,
+    # returns whether it was a new comment, raises ValueError/TypeError on a bad data-index
+    comm_res = comment_pattern.findall(item['text'])
+    if not comm_res:
+        return False
+    hash_str = ''.join([comm_res[0][0], comm_res[0][1], comm_res[0][2]])
+    if hash_str in comments_set:
+        return False
+    comments_set.add(hash_str)
+    data_index = int(item['index'])
+    uid = ''
+    if item['href'] and (res := uid_pattern.findall(item['href'])):
+        uid = res[0]
+    comments['set'].add(data_index)
+    for nick_name, comment_content, comment_time in comm_res:
+        comments['comms'].append((uid, nick_name, item['avator'], comment_time, comment_content))
+    return True
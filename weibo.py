@@ -3,30 +3,111 @@ from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, NoSuchWindowException, WebDriverException
 from selenium.webdriver.chrome.service import Service
 
 from wb_data import WbData
-import re, time, logging
-from datetime import datetime
+from near_dup import NearDupIndex
+from checkpoint import Checkpoint
+from sinks import DbSink, JsonlSink, StdoutSink, strtime
+from snapshots import SnapshotArchive
+from comment_api import CommentApi
+from wb_parse import comment_pattern, uid_pattern, parse_user_link, parse_comment_item
+from metrics import Metrics, Reporter, timed
+from browser import MemoryWatchdog, block_resources
+from pager import SearchPrefetcher
+from waits import Waiter, Backoff, new_window, document_ready, count_changed, network_idle
+import wb_js
+import time, json, logging, argparse
 
 class WeiboSpider:
+    item_count_script = "return document.querySelectorAll('.vue-recycle-scroller__item-view').length;"
     base_url = "https://weibo.com/"
     search_url = "https://s.weibo.com/weibo?q="
 
-    def __init__(self, chromedriver_path: str, comments_path: str, debug_port: int=9222, log_level=logging.DEBUG):
+    def __init__(self, chromedriver_path: str, comments_path: str, debug_port: int=9222, log_level=logging.DEBUG,
+                 batch_cards: bool=True, comment_mode: str='observer', drain_interval: float=0.5, detail_pool=None,
+                 write_behind: bool=True, checkpoint: Checkpoint=None, refresh_after: float=None,
+                 sinks: list=None, snapshots: SnapshotArchive=None, comment_api=None, metrics: Metrics=None,
+                 driver=None, db: WbData=None, lean: bool=False, watchdog: MemoryWatchdog=None,
+                 prefetch: int=0):
         self.log = logging.getLogger(__name__)
         self.log.setLevel(log_level)
-        self.service = Service(chromedriver_path)
-        self.options = webdriver.ChromeOptions()
-        self.options.add_experimental_option("debuggerAddress", f"127.0.0.1:{debug_port}")
-        self.driver = webdriver.Chrome(service=self.service, options=self.options)
-        self.db = WbData("users.sqlite", comments_path)
-    
-    def __del__(self):
-        self.db.close()
+        self.batch_cards = batch_cards
+        self.comment_mode = comment_mode
+        self.drain_interval = drain_interval
+        self.detail_pool = detail_pool
+        self.checkpoint = checkpoint
+        self.refresh_after = refresh_after
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.reporter = None
+        self.chromedriver_path = chromedriver_path
+        self.debug_port = debug_port
+        # lean: images, media and fonts blocked, one detail tab navigated from post to post
+        self.lean = lean
+        self.watchdog = watchdog
+        self.detail_handle = None
+        # result pages fetched ahead over http, see iter_prefetched
+        self.prefetch = prefetch
+        if driver is None:
+            driver = self.attach_driver(chromedriver_path, debug_port)
+        # an already attached driver, e.g. a batch session or fake_driver.FakeDriver for the benchmarks
+        self.driver = self.metrics.instrument(driver)
+        self.waiter = Waiter(self.driver)
+        if self.lean:
+            block_resources(self.driver)
+        # an opened db is shared with the caller and stays open on close()
+        self.own_db = db is None
+        if db is None and comments_path:
+            db = WbData("users.sqlite", comments_path, write_behind=write_behind)
+        # detail workers of a DetailPool run without a database, results go through the crawling spider
+        self.db = db
+        if self.db is not None:
+            self.db.set_metrics(self.metrics)
+        if sinks is None:
+            sinks = [DbSink(self.db)] if self.db is not None else []
+        self.sinks = sinks
+        self.snapshots = snapshots
+        self.comment_api = comment_api
+
+    @staticmethod
+    def attach_driver(chromedriver_path: str, debug_port: int=9222):
+        service = Service(chromedriver_path)
+        options = webdriver.ChromeOptions()
+        options.add_experimental_option("debuggerAddress", f"127.0.0.1:{debug_port}")
+        return webdriver.Chrome(service=service, options=options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.detail_handle is not None:
+            try:
+                self.close_detail_tab()
+            except WebDriverException as e:
+                self.log.warning("[-] close detail tab failed: %s" % str(e))
+        for sink in self.sinks:
+            sink.close()
+        if self.comment_api is not None:
+            self.comment_api.close()
+        if self.detail_pool is not None:
+            self.detail_pool.close()
+        if self.db is not None and self.own_db:
+            self.db.close()
+        if self.reporter is not None:
+            self.reporter.stop()
+            self.reporter = None
+        else:
+            self.log.info(self.metrics.summary())
+
+    def start_reporter(self, interval: float=60, path: str=None, fmt: str='json'):
+        self.reporter = Reporter(self.metrics, interval, path, fmt, self.log)
+        self.reporter.start()
+        return self.reporter
     
     def parse_avator(self, parent: WebElement, feed: dict):
         try:
@@ -40,8 +121,8 @@ class WeiboSpider:
             except NoSuchElementException:
                 self.log.warning("[-] card [%s](%s) not has user link" % (feed['mid'], self.driver.current_url))
             else:
-                if matched := re.findall('https://weibo.com/(\d+)?.*', user_link):
-                    feed['uid'] = matched[0]
+                if (uid := parse_user_link(user_link)) is not None:
+                    feed['uid'] = uid
             try:
                 img_elem = avator_elem.find_element(By.TAG_NAME, "img")
             except NoSuchElementException:
@@ -89,18 +170,34 @@ class WeiboSpider:
             feed['content'] = wbtext_elem.text
 
         # get weibo comments
+        if self.comment_mode == 'api':
+            # fetched over http while the next detail page loads, see resolve_comments
+            feed['comments_future'] = self.comment_api.submit(feed['mid'], feed.get('uid'))
+            if self.snapshots is not None:
+                self.snapshots.save_detail(feed['mid'], self.driver.page_source)
+            return
+
         feed['comments'] = { 'set': set(), 'comms': list(), 'finish': None }
-        self.new_tab_comments(feed['comments'])
+        raw_items = [] if self.snapshots is not None else None
+        if self.comment_mode == 'observer':
+            self.new_tab_comments_observed(feed['comments'], raw_items)
+        else:
+            self.new_tab_comments(feed['comments'])
+
+        if self.snapshots is not None:
+            self.snapshots.save_detail(feed['mid'], self.driver.page_source, raw_items)
 
+    @timed('new_tab_comments')
     def new_tab_comments(self, comments: dict):
         self.driver.execute_script('window.scrollBy(0, document.body.scrollHeigth)')
         is_finish = False
         comments_set = set()
         sentinel_time  = time.time()
         last_time = sentinel_time
-        time_distance1 = 60
-        time_distance2 = 120
+        backoff = Backoff(self.waiter, 'comment_gap')
+        refresh_scale = 2
         while not is_finish:
+            harvested = len(comments_set)
             try:
                 items = self.driver.find_elements(By.CLASS_NAME, "vue-recycle-scroller__item-view")
             except NoSuchElementException:
@@ -111,7 +208,7 @@ class WeiboSpider:
                     is_finish = True
                 for item in items:
                     try:
-                        comm_res = re.findall(r"(.*)\s?:(.*)\s((?:\d{,2}\-?){3}\s?(?:\d{1,2}:\d{1,2}))\s?", item.text)
+                        comm_res = comment_pattern.findall(item.text)
                         if not comm_res:
                             continue
                         hash_str = ''.join([comm_res[0][0], comm_res[0][1], comm_res[0][2]])
@@ -134,7 +231,7 @@ class WeiboSpider:
                         try:
                             uid = ''
                             uid_elem = scroller_elem.find_element(By.TAG_NAME, "a")
-                            if res := re.findall("/u/(\d+)", uid_elem.get_attribute('href')):
+                            if res := uid_pattern.findall(uid_elem.get_attribute('href')):
                                 uid = res[0]
                         except NoSuchElementException:
                             pass
@@ -142,6 +239,8 @@ class WeiboSpider:
                             for nick_name, comment_content, comment_time in comm_res:
                                 comments['comms'].append((uid, nick_name, avator, comment_time, comment_content))
             finally:
+                if len(comments_set) != harvested:
+                    backoff.progress()
                 try:
                     bottom_elem = self.driver.find_element(By.XPATH, "//div[starts-with(@class, 'Bottom_text_')]")
                 except NoSuchElementException:
@@ -150,11 +249,12 @@ class WeiboSpider:
                             for e in es:
                                 if e.text.find("加载失败") > 0:
                                     try:
+                                        count = self.driver.execute_script(self.item_count_script)
                                         e.click()
                                     except Exception:
                                         pass
                                     else:
-                                        time.sleep(1)
+                                        self.waiter.attempt('retry', count_changed(self.item_count_script, count), 5)
                                     break
                                 elif e.text.find("发表你的评论或") > 0:
                                     comments['finish'] = e.text
@@ -165,20 +265,107 @@ class WeiboSpider:
                     finally:
                         self.driver.execute_script('window.scrollBy(0, 200)')
                         current_time = time.time()
-                        if int(current_time - last_time) > time_distance2:
-                            self.driver.refresh()
-                            time_distance2 *= 2
-                            time.sleep(5)
+                        if int(current_time - last_time) > refresh_scale * backoff.delay():
+                            self.refresh_comments()
+                            refresh_scale *= 2
                             last_time = time.time()
-                        elif int(current_time - sentinel_time) > time_distance1:
-                            self.driver.execute_script('window.scrollBy(0, -500)')
-                            time.sleep(1)
-                            sentinel_time = time.time() 
+                        elif int(current_time - sentinel_time) > backoff.delay():
+                            self.scroll_back()
+                            sentinel_time = time.time()
                 else:
                     if comments['finish'] is None:
                         comments['finish'] = bottom_elem.text
 
-        
+
+    def retry_comments(self):
+        try:
+            for e in self.driver.find_elements(By.XPATH, "//span[@class='woo-tip-text']"):
+                if e.text.find("加载失败") > 0:
+                    count = self.driver.execute_script(self.item_count_script)
+                    e.click()
+                    self.waiter.attempt('retry', count_changed(self.item_count_script, count), 5)
+                    break
+        except Exception:
+            pass
+
+    def refresh_comments(self):
+        self.driver.refresh()
+        self.waiter.attempt('refresh', document_ready, 30)
+        self.waiter.attempt('refresh_items', count_changed(self.item_count_script, 0), 10)
+
+    def scroll_back(self):
+        self.driver.execute_script('window.scrollBy(0, -500)')
+        self.waiter.attempt('scroll_back', network_idle(0.3), 3)
+
+    @staticmethod
+    def comments_buffered(driver):
+        return driver.execute_script(wb_js.COMMENTS_BUFFERED) != 0
+
+    @timed('new_tab_comments')
+    def new_tab_comments_observed(self, comments: dict, raw_items: list=None):
+        # the page scrolls itself and buffers every newly rendered comment, see wb_js.COMMENT_OBSERVER
+        self.driver.execute_script(wb_js.COMMENT_OBSERVER, 300, 200)
+        comments_set = set()
+        sentinel_time  = time.time()
+        last_time = sentinel_time
+        backoff = Backoff(self.waiter, 'comment_gap')
+        refresh_scale = 2
+        while True:
+            try:
+                state = self.driver.execute_script(wb_js.DRAIN_COMMENTS)
+            except WebDriverException as e:
+                self.log.warning("[-] [%s] drain comments failed: %s" % (self.driver.current_url, str(e)))
+                break
+            if state is None:
+                # the observer is lost after a refresh
+                self.driver.execute_script(wb_js.COMMENT_OBSERVER, 300, 200)
+                continue
+
+            if state['items']:
+                backoff.progress()
+                if raw_items is not None:
+                    raw_items.extend(state['items'])
+            for item in state['items']:
+                try:
+                    if not parse_comment_item(item, comments, comments_set):
+                        continue
+                except (TypeError, ValueError) as e:
+                    self.log.warning("[-] [%s] has value error: %s" % (self.driver.current_url, str(e)))
+                    continue
+                sentinel_time = time.time()
+                last_time = sentinel_time
+
+            if (comments['finish'] is not None or state['rendered'] == 0) and not state['items']:
+                break
+
+            if state['bottom'] is not None:
+                if comments['finish'] is None:
+                    comments['finish'] = state['bottom']
+            else:
+                for tip in state['tips']:
+                    if tip.find("加载失败") > 0:
+                        self.retry_comments()
+                        break
+                    elif tip.find("发表你的评论或") > 0:
+                        comments['finish'] = tip
+                        break
+
+            current_time = time.time()
+            if int(current_time - last_time) > refresh_scale * backoff.delay():
+                self.refresh_comments()
+                refresh_scale *= 2
+                last_time = time.time()
+            elif int(current_time - sentinel_time) > backoff.delay():
+                self.scroll_back()
+                sentinel_time = time.time()
+            elif comments['finish'] is None:
+                self.waiter.attempt('comments', self.comments_buffered, self.drain_interval * 4)
+
+        try:
+            self.driver.execute_script(wb_js.STOP_COMMENT_OBSERVER)
+        except WebDriverException:
+            pass
+
     def new_tab(self, card_feed: WebElement, feed: dict):
         try:
             new_link_elem = card_feed.find_element(By.CLASS_NAME, 'from')
@@ -187,33 +374,110 @@ class WeiboSpider:
             self.log.warning("[-] card [%s](%s) not has from: %s" % (feed['mid'], self.driver.current_url, str(e)))
         else:
             link = link_elem.get_attribute('href')
-            index = link.find('?')
-            if index > 0:
-                link = link[:index]
-            
-            pre_handle = self.driver.current_window_handle
-            link_elem.send_keys(Keys.RETURN)
-            time.sleep(2)
-            handles = self.driver.window_handles
-            for handle in handles:
-                if pre_handle != handle:
-                    self.driver.switch_to.window(handle)
-            try:
-                WebDriverWait(self.driver, 30).until(EC.text_to_be_present_in_element_attribute(
-                    (By.XPATH, f'//a[starts-with(@class, "head-info_time")]'), 'href', link)
-                )
-            except TimeoutException:
-                self.log.warning("[-] card [%s](%s) new tab [%s] failed" % (feed['mid'], self.driver.current_url, link))
+            if self.detail_pool is not None:
+                feed['link'] = link
             else:
-                self.parse_new_tab(feed)
-            finally:
-                if pre_handle != self.driver.current_window_handle:
-                    self.driver.close()
-                    self.driver.switch_to.window(pre_handle)
+                self.open_tab(link_elem, link, feed)
+
+    @staticmethod
+    def strip_link(link: str):
+        index = link.find('?')
+        if index > 0:
+            link = link[:index]
+        return link
+
+    def wait_detail(self, link: str, feed: dict):
+        try:
+            self.waiter.until('detail', EC.text_to_be_present_in_element_attribute(
+                (By.XPATH, f'//a[starts-with(@class, "head-info_time")]'), 'href', link), 30
+            )
+        except TimeoutException:
+            self.log.warning("[-] card [%s](%s) new tab [%s] failed" % (feed['mid'], self.driver.current_url, link))
+            return False
+        else:
+            self.parse_new_tab(feed)
+            return True
+
+    @timed('new_tab')
+    def open_detail(self, link: str, feed: dict):
+        # navigate the current tab to the detail page, used by the DetailPool workers
+        link = self.strip_link(link)
+        self.driver.get(link)
+        return self.wait_detail(link, feed)
+
+    def switch_detail_tab(self):
+        if self.detail_handle is not None:
+            try:
+                self.driver.switch_to.window(self.detail_handle)
+                return
+            except NoSuchWindowException:
+                self.detail_handle = None
+        self.driver.switch_to.new_window('tab')
+        self.detail_handle = self.driver.current_window_handle
+        block_resources(self.driver)
+
+    def close_detail_tab(self):
+        if self.detail_handle is None:
+            return
+        pre_handle = self.driver.current_window_handle
+        try:
+            if pre_handle != self.detail_handle:
+                self.driver.switch_to.window(self.detail_handle)
+            self.driver.close()
+        except NoSuchWindowException:
+            pass
+        if pre_handle != self.detail_handle:
+            self.driver.switch_to.window(pre_handle)
+        self.detail_handle = None
+
+    @timed('new_tab')
+    def open_lean_tab(self, link: str, feed: dict):
+        # the detail tab is reused, no tab is opened or closed per post
+        link = self.strip_link(link)
+        pre_handle = self.driver.current_window_handle
+        try:
+            self.switch_detail_tab()
+            self.driver.get(link)
+            return self.wait_detail(link, feed)
+        finally:
+            self.driver.switch_to.window(pre_handle)
+
+    @timed('new_tab')
+    def open_tab(self, link_elem: WebElement, link: str, feed: dict):
+        if self.lean:
+            return self.open_lean_tab(link, feed)
+        link = self.strip_link(link)
+        pre_handle = self.driver.current_window_handle
+        pre_handles = self.driver.window_handles
+        link_elem.send_keys(Keys.RETURN)
+        if handle := self.waiter.attempt('new_tab', new_window(pre_handles), 10):
+            self.driver.switch_to.window(handle)
+        try:
+            self.wait_detail(link, feed)
+        finally:
+            if pre_handle != self.driver.current_window_handle:
+                self.driver.close()
+                self.driver.switch_to.window(pre_handle)
+
+    def open_link(self, link: str, feed: dict):
+        if self.lean:
+            return self.open_lean_tab(link, feed)
+        return self.open_detail(link, feed)
 
+    def is_known(self, mid: str):
+        # harvested posts are skipped before any detail tab is opened
+        if self.checkpoint is not None:
+            if self.checkpoint.is_done(mid, self.refresh_after):
+                return True
+            if mid in self.checkpoint.mids:
+                self.log.info("[.] refresh comments of [%s]" % mid)
+                return False
+        return self.db is not None and mid in self.db.select_known_mids([mid])
+
+    @timed('parse_card')
     def parse_card(self, parent: WebElement):
         mid = parent.get_attribute('mid')
-        if mid is None:
+        if mid is None or self.is_known(mid):
             return None
         feed_dict = { 'mid':  mid , 'top': ''}
         try:
@@ -249,35 +513,146 @@ class WeiboSpider:
     
     @staticmethod
     def strtime(wb_time: str):
-        return datetime.strptime('20' + wb_time, "%Y-%m-%d %H:%M").strftime("%Y-%m-%d %H:%M")
+        return strtime(wb_time)
+
+    @timed('extract_cards')
+    def extract_cards(self):
+        # one round trip for every card on the search page, see wb_js.EXTRACT_CARDS
+        try:
+            cards = self.driver.execute_script(wb_js.EXTRACT_CARDS)
+        except WebDriverException as e:
+            self.log.warning("[-] extract cards (%s) failed: %s" % (self.driver.current_url, str(e)))
+            return None
+        else:
+            return cards
+
+    @timed('parse_card')
+    def parse_card_data(self, card: dict):
+        if self.is_known(card['mid']):
+            return None
+        feed_dict = { 'mid': card['mid'], 'top': card['top'] or '' }
+        if not card['has_card']:
+            return feed_dict
+
+        if card['feed'] is None and not card.get('has_feed'):
+            self.log.warning("[-] card [%s](%s) not has card-feed" % (feed_dict['mid'], self.driver.current_url))
+            return feed_dict
+
+        if not card['has_avator']:
+            self.log.warning("[-] card [%s](%s) not has avator" % (feed_dict['mid'], self.driver.current_url))
+        else:
+            if card['user_link'] is None:
+                self.log.warning("[-] card [%s](%s) not has user link" % (feed_dict['mid'], self.driver.current_url))
+            elif (uid := parse_user_link(card['user_link'])) is not None:
+                feed_dict['uid'] = uid
+            if card['avator'] is None:
+                self.log.warning("[-] card [%s](%s) not has user avator" % (feed_dict['mid'], self.driver.current_url))
+            else:
+                feed_dict['avator'] = card['avator']
+
+        if card['nick_name'] is None:
+            self.log.warning("[-] card [%s](%s) not has nick_name" % (feed_dict['mid'], self.driver.current_url))
+        else:
+            feed_dict['nick_name'] = card['nick_name']
+
+        if not card['has_from']:
+            self.log.warning("[-] card [%s](%s) not has nofollow" % (feed_dict['mid'], self.driver.current_url))
+        else:
+            feed_dict['from'] = card['from']
+
+        if card['link'] is None:
+            self.log.warning("[-] card [%s](%s) not has from" % (feed_dict['mid'], self.driver.current_url))
+        elif self.detail_pool is not None:
+            feed_dict['link'] = card['link']
+        elif card['link_elem'] is None:
+            # prefetched cards carry no elements, the detail page is opened by its link
+            self.open_link(card['link'], feed_dict)
+        else:
+            self.open_tab(card['link_elem'], card['link'], feed_dict)
+
+        return feed_dict
+
+    def write_feeds(self, feeds, sinks: list=None):
+        sinks = self.sinks if sinks is None else sinks
+        for feed in feeds:
+            with self.metrics.stage('db_write'):
+                for sink in sinks:
+                    sink.write(feed)
+            self.metrics.count('posts')
+            self.metrics.count('comments', len(feed['comments']['comms']))
+            if self.checkpoint is not None:
+                self.checkpoint.done(feed['mid'])
+            yield feed
+
+    def flush_sinks(self):
+        # rows queued behind the writer reach the database before the checkpoint on disk names their mids
+        for sink in self.sinks:
+            sink.flush()
+        if self.db is not None:
+            self.db.flush()
+
+    def checkpoint_page(self, page: int):
+        self.flush_sinks()
+        self.checkpoint.set_page(page)
+
+    def checkpoint_finish(self):
+        self.flush_sinks()
+        self.checkpoint.finish()
+
+    def crawl_details(self, feeds):
+        if self.detail_pool is None:
+            return feeds
+        feeds = list(feeds)
+        self.detail_pool.crawl([feed for feed in feeds if feed and 'link' in feed])
+        return feeds
+
+    def resolve_comments(self, feeds):
+        if self.comment_mode != 'api':
+            return feeds
+        feeds = list(feeds)
+        for feed in feeds:
+            if feed and (future := feed.pop('comments_future', None)) is not None:
+                # a failed fetch leaves the post unfinished, complete_feeds keeps it for a resume
+                if (comments := future.result()) is not None:
+                    feed['comments'] = comments
+                else:
+                    self.log.warning("[-] [%s] comments not fetched, post left unfinished" % feed['mid'])
+        return feeds
+
+    def complete_feeds(self, feeds, page: int):
+        # a page crawled in the browser ends at the first card without a detail page, details and
+        # comments fetched up front (pool, comment api) only skip it. unfinished posts keep the page in the checkpoint
+        for feed in feeds:
+            if feed:
+                if 'comments' not in feed:
+                    if self.checkpoint is not None:
+                        self.checkpoint.leave(feed['mid'], page)
+                    if self.detail_pool is not None or self.comment_mode == 'api':
+                        continue
+                    break
+                yield feed
+
+    def iter_feed_items(self, page: int=1):
+        if self.batch_cards:
+            if (cards := self.extract_cards()) is not None:
+                yield from self.complete_feeds(self.resolve_comments(
+                    self.crawl_details(self.parse_card_data(card) for card in cards)), page)
+                return
+            self.log.warning("[-] fall back to per element card parsing (%s)" % self.driver.current_url)
 
-    def get_feed_items(self):
         try:
             feed_items = self.driver.find_elements(By.XPATH, '//div[@action-type="feed_list_item"]')
         except Exception as e:
-            self.log.error("[-] get_feed_items error: %s")
-            return None
+            self.log.error("[-] get_feed_items error: %s" % str(e))
+            return
         else:
-            feed_lists = []
-            
-            for feed_item in feed_items:
-                if feed := self.parse_card(feed_item):
-                    if 'comments' not in feed:
-                        break
-                    users = [(feed['uid'], feed['nick_name'], feed['avator'])]
-                    for comment in feed['comments']['comms']:
-                        users.append((comment[0], comment[1], comment[2]))
-                    self.db.insert_users(users)
-                    self.db.insert_messages([(
-                        feed['mid'], feed['uid'], feed['top'], feed['from'], self.strtime(feed['time']), feed['content']
-                    )])
-                    self.db.insert_comments([
-                        (feed['mid'], comment[0], self.strtime(comment[3]), comment[4]) for comment in feed['comments']['comms']
-                    ])
-                    feed_lists.append(feed)
-            
-            return feed_lists
+            yield from self.complete_feeds(self.resolve_comments(
+                self.crawl_details(self.parse_card(feed_item) for feed_item in feed_items)), page)
+
+    def get_feed_items(self, page: int=1):
+        return list(self.write_feeds(self.iter_feed_items(page)))
     
+    @timed('next_page')
     def next_page(self, question):
         try:
             next_page_elem = self.driver.find_element(By.CLASS_NAME, "next")
@@ -288,8 +663,8 @@ class WeiboSpider:
             is_find = False
             for word in question.split(' '):
                 try:
-                    WebDriverWait(self.driver, 15).until(EC.text_to_be_present_in_element(
-                        (By.XPATH, '//p[@node-type="feed_list_content"]'), word)
+                    self.waiter.until('next_page', EC.text_to_be_present_in_element(
+                        (By.XPATH, '//p[@node-type="feed_list_content"]'), word), 15
                     )
                 except TimeoutException:
                     continue
@@ -298,29 +673,148 @@ class WeiboSpider:
                     break
             return is_find
 
-    def crawling(self, question):
-        all_feeds = []
+    def iter_feeds(self, question, page: int=1, pages: int=None):
+        # yields every finished feed, only the in-flight post is held in memory.
+        # with pages set it stops after that many pages, the checkpoint keeps the next one
+        crawled = 0
         while True:
-            feeds = self.get_feed_items()
-            all_feeds.append(feeds)
+            if self.snapshots is not None:
+                self.snapshots.save_search(question, page, self.driver.page_source)
+            yield from self.iter_feed_items(page)
+            crawled += 1
+            if pages is not None and crawled >= pages:
+                if self.driver.find_elements(By.CLASS_NAME, "next"):
+                    if self.checkpoint is not None:
+                        self.checkpoint_page(page + 1)
+                    return
+                break
+            if self.watchdog is not None and self.watchdog.over(self.driver):
+                if not self.driver.find_elements(By.CLASS_NAME, "next"):
+                    break
+                page += 1
+                if self.checkpoint is not None:
+                    self.checkpoint_page(page)
+                if not self.recover(question, page):
+                    # not finished, a later resume continues from the checkpoint
+                    return
+                continue
             try:
                 if not self.next_page(question):
                     break
             except Exception:
                 break
+            page += 1
+            if self.checkpoint is not None:
+                self.checkpoint_page(page)
+        if self.checkpoint is not None:
+            self.checkpoint_finish()
+        self.log.info("[.] wait stats: %s" % json.dumps(self.waiter.report()))
+
+    def iter_prefetched(self, question, page: int=1, pages: int=None):
+        # the open result page is crawled in the browser, the following ones are fetched and parsed
+        # by a SearchPrefetcher meanwhile and their details opened by link
+        has_next = len(self.driver.find_elements(By.CLASS_NAME, "next")) > 0
+        prefetcher = None
+        if has_next and (pages is None or pages > 1):
+            prefetcher = SearchPrefetcher.from_driver(self.driver, question, page + 1, lookahead=self.prefetch,
+                                                      metrics=self.metrics, log_level=self.log.level)
+            prefetcher.start()
+        try:
+            if self.snapshots is not None:
+                self.snapshots.save_search(question, page, self.driver.page_source)
+            yield from self.iter_feed_items(page)
+            crawled = 1
+            while has_next:
+                if pages is not None and crawled >= pages:
+                    if self.checkpoint is not None:
+                        self.checkpoint_page(page + 1)
+                    return
+                with self.metrics.stage('next_page'):
+                    item = prefetcher.get()
+                if item is None:
+                    break
+                page, cards, has_next, source = item
+                if self.checkpoint is not None:
+                    self.checkpoint_page(page)
+                if cards is None:
+                    self.log.warning("[-] fall back to browser paging at page %d" % page)
+                    prefetcher.stop()
+                    prefetcher = None
+                    if self.open_search(question, page):
+                        yield from self.iter_feeds(question, page, pages - crawled if pages is not None else None)
+                    return
+                if self.snapshots is not None:
+                    self.snapshots.save_search(question, page, source)
+                yield from self.complete_feeds(self.resolve_comments(
+                    self.crawl_details(self.parse_card_data(card) for card in cards)), page)
+                crawled += 1
+                if self.watchdog is not None and self.watchdog.over(self.driver) and not self.restart_browser():
+                    return
+        finally:
+            if prefetcher is not None:
+                prefetcher.stop()
+        if self.checkpoint is not None:
+            self.checkpoint_finish()
+        self.log.info("[.] wait stats: %s" % json.dumps(self.waiter.report()))
 
-        for feed in all_feeds:
-            print(feed)
+    def crawling(self, question, page: int=1, sinks: list=None, pages: int=None):
+        count = 0
+        feeds = self.iter_prefetched(question, page, pages) if self.prefetch else self.iter_feeds(question, page, pages)
+        for _ in self.write_feeds(feeds, sinks):
+            count += 1
+        self.log.info("[.] %s crawled %d feeds" % (question, count))
+        return count
 
-    def search(self, question: str):
+    def recycle_tabs(self):
+        # fresh renderers for the search and detail tabs, the other tabs of the browser are left alone
+        self.close_detail_tab()
+        search_handle = self.driver.current_window_handle
+        self.driver.switch_to.new_window('tab')
+        handle = self.driver.current_window_handle
+        self.driver.switch_to.window(search_handle)
+        self.driver.close()
+        self.driver.switch_to.window(handle)
+
+    def quit_driver(self):
+        # the chromedriver of a killed browser is still running
+        try:
+            self.driver.quit()
+        except Exception as e:
+            self.log.warning("[-] quit old driver failed: %s" % str(e))
+
+    def restart_browser(self):
+        # the browser passed the memory limit: restart and reattach it, or at least recycle the tabs
+        self.log.warning("[-] browser uses %.0fMB, restart it" % (self.watchdog.last_usage / 1024 / 1024))
+        try:
+            if self.watchdog.restart():
+                self.detail_handle = None
+                self.quit_driver()
+                self.driver = self.metrics.instrument(self.attach_driver(self.chromedriver_path, self.debug_port))
+                self.waiter = Waiter(self.driver)
+            else:
+                self.recycle_tabs()
+            if self.lean:
+                block_resources(self.driver)
+        except WebDriverException as e:
+            self.log.error("[-] recover browser failed: %s" % str(e))
+            return False
+        return True
+
+    def recover(self, question: str, page: int):
+        return self.restart_browser() and self.open_search(question, page)
+
+    @timed('search')
+    def open_search(self, question: str, page: int=1):
         url = self.search_url + question
+        if page > 1:
+            url += "&page=%d" % page
         self.driver.get(url)
         
         is_find = False
         for word in question.split(' '):
             try:
-                WebDriverWait(self.driver, 10).until(EC.text_to_be_present_in_element(
-                    (By.XPATH, '//p[@node-type="feed_list_content"]'), word)
+                self.waiter.until('search', EC.text_to_be_present_in_element(
+                    (By.XPATH, '//p[@node-type="feed_list_content"]'), word), 10
                 )
             except TimeoutException:
                 continue
@@ -329,16 +823,74 @@ class WeiboSpider:
                 break
         if not is_find:
             self.log.error("[-] search %s failed" % url)
+        return is_find
+
+    def search(self, question: str, page: int=1, sinks: list=None, pages: int=None):
+        if not self.open_search(question, page):
             return False
 
-        self.log.info("[.] start crawling ...")
-        self.crawling(question)
+        self.log.info("[.] start crawling from page %d ..." % page)
+        self.crawling(question, page, sinks, pages)
+        return True
+
+    def resume(self, question: str, pages: int=None):
+        if self.checkpoint is None:
+            return self.search(question, pages=pages)
+        if self.checkpoint.finished:
+            self.log.info("[.] %s already finished, %d posts" % (question, len(self.checkpoint.mids)))
+            return True
+        return self.search(question, self.checkpoint.resume_page(), pages=pages)
 
 
 if __name__ == '__main__':
-    driver_path = "chromedriver.exe"
-    chrome_port = 9222
-    question = "乌克兰"
-    
-    spider = WeiboSpider(driver_path, comments_path=question.replace(' ', '_') + '.db', debug_port=chrome_port)
-    spider.search(question)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('question', nargs='?', default="乌克兰")
+    parser.add_argument('--driver', default="chromedriver.exe")
+    parser.add_argument('--port', type=int, default=9222)
+    parser.add_argument('--resume', action='store_true', help="continue from the last checkpoint")
+    parser.add_argument('--refresh-after', type=float, default=None,
+                        help="hours after which the comments of a harvested post are crawled again")
+    parser.add_argument('--jsonl', default=None, help="also append the feeds to a jsonl file")
+    parser.add_argument('--stdout', action='store_true', help="also print the feeds")
+    parser.add_argument('--comment-api', default=None, metavar='BASE_URL',
+                        help="fetch comments from the json comment api instead of scrolling")
+    parser.add_argument('--lean', action='store_true', help="block images, media and fonts and reuse one detail tab")
+    parser.add_argument('--memory-limit', type=float, default=None, metavar='MB',
+                        help="recover the browser when its footprint passes this limit")
+    parser.add_argument('--chrome-command', default=None,
+                        help="command line that starts the browser with --remote-debugging-port, used to restart it")
+    parser.add_argument('--prefetch', type=int, default=0, metavar='PAGES',
+                        help="fetch up to this many result pages ahead over http while details are crawled")
+    parser.add_argument('--near-dup', choices=['tag', 'collapse'], default=None,
+                        help="tag near duplicated posts and comments with dup_of, or drop the comments")
+    parser.add_argument('--metrics', default=None, help="file the periodic metrics report is written to")
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json')
+    parser.add_argument('--metrics-interval', type=float, default=60)
+    args = parser.parse_args()
+
+    question = args.question
+    path = question.replace(' ', '_')
+    checkpoint = Checkpoint(path + '.checkpoint.json', question)
+    if not args.resume:
+        checkpoint.restart()
+    refresh_after = args.refresh_after * 3600 if args.refresh_after is not None else None
+
+    near_dup = NearDupIndex(collapse=args.near_dup == 'collapse') if args.near_dup else None
+    db = WbData("users.sqlite", path + '.db', write_behind=True, near_dup=near_dup)
+    sinks = [DbSink(db)]
+    if args.jsonl:
+        sinks.append(JsonlSink(args.jsonl))
+    if args.stdout:
+        sinks.append(StdoutSink())
+
+    with WeiboSpider(args.driver, None, db=db, debug_port=args.port,
+                     checkpoint=checkpoint, refresh_after=refresh_after, sinks=sinks,
+                     comment_mode='api' if args.comment_api else 'observer', lean=args.lean,
+                     watchdog=MemoryWatchdog(args.memory_limit, args.port, args.chrome_command)
+                     if args.memory_limit else None, prefetch=args.prefetch) as spider:
+        if args.comment_api:
+            spider.comment_api = CommentApi.from_driver(spider.driver, base_url=args.comment_api)
+        if args.metrics:
+            spider.start_reporter(args.metrics_interval, args.metrics, args.metrics_format)
+        spider.resume(question)
+    db.close()
@@ -1,9 +1,34 @@
 from wb_data import WbData
-import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from token_store import TokenStore
+from export import export, exporters
+from tokenizer import word_pattern, default_stopwords, load_stopwords, init_worker, tokenize
+import os, argparse
 import jieba
 import wordcloud
-import xlwt
 
+# the report keeps the sheet and header of the old xls export
+report_sheet = '词频'
+report_labels = ['单词', '出现次数']
+
+
+def count_words(db: WbData, chunk_size: int=2000, workers: int=None, stopwords: frozenset=default_stopwords,
+                skip_dups: bool=False):
+    # one-off counts without the TokenStore tables (--no-store), nothing is written to the corpus.
+    # chunks are tokenized in a process pool, at most two chunks per worker are in flight
+    counts = Counter()
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(stopwords,)) as pool:
+        limit = 2 * workers
+        pending = []
+        for chunk in db.iter_contents(chunk_size, skip_dups):
+            pending.append(pool.submit(tokenize, chunk))
+            if len(pending) >= limit:
+                counts.update(pending.pop(0).result())
+        for future in pending:
+            counts.update(future.result())
+    return counts
 
 def get_text_from_db(user_path: str, wb_path: str):
     db = WbData(user_path, wb_path)
@@ -12,43 +37,49 @@ def get_text_from_db(user_path: str, wb_path: str):
     return contents
 
 def split_contents(contents):
-    counts = dict()
-    res = ''
-    for s in jieba.lcut(contents):
-        if re.match("\w+", s) and len(s) > 1:
-            if s not in counts:
-                counts[s] = 0
-            counts[s] += 1
-            if res == '':
-                res += s
-            else:
-                res += ' ' +  s 
-    return res, counts
-
-def generate(string: str, png: str):
+    words = [ s for s in jieba.lcut(contents) if word_pattern.match(s) and len(s) > 1 ]
+    return ' '.join(words), Counter(words)
+
+def generate(frequencies: dict, png: str):
     w = wordcloud.WordCloud(width=1000,
                         height=700,
                         background_color='white',
                         font_path='msyh.ttc',
                         collocations=False)
-    w.generate(string)
+    w.generate_from_frequencies(frequencies)
     w.to_file(png)
 
-def write_to_excel(excel_path: str, sheet_name: str, data: list):
-    workbook = xlwt.Workbook()
-    sheet = workbook.add_sheet(sheet_name)
-    for i in range(len(data)):
-        for j in range(len(data[i])):
-            sheet.write(i, j, data[i][j])
-    workbook.save(excel_path)
-
 if __name__ == '__main__':
-    question = "乌克兰 俄罗斯"
-    path = question.replace(' ', '_')
-    contents = get_text_from_db("users.sqlite",  path + ".db")
-    strings, counts = split_contents(contents)
-    generate(strings, path + '.png')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('question', nargs='?', default="乌克兰 俄罗斯")
+    parser.add_argument('--start', default=None, help="only posts and comments since this time, e.g. 2022-03-01")
+    parser.add_argument('--end', default=None, help="only posts and comments before this time")
+    parser.add_argument('--mid', action='append', default=None, help="only these posts")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--skip-duplicates', action='store_true', help="leave out near duplicated posts and comments")
+    parser.add_argument('--stopwords', default=None,
+                        help="file with one extra stopword per line, applies to the rows tokenized from now on")
+    parser.add_argument('--no-store', action='store_true',
+                        help="count the whole corpus in memory with these stopwords instead of the stored token counts")
+    args = parser.parse_args()
+    if args.no_store and (args.start or args.end or args.mid):
+        parser.error("--start/--end/--mid need the stored token counts")
 
-    lists = sorted(counts.items(), key = lambda kv:(kv[1], kv[0]))
-    lists.reverse()
-    write_to_excel(path + ".xls", "词频", [('单词', '出现次数')] + lists)
+    question = args.question
+    path = question.replace(' ', '_')
+    stopwords = load_stopwords(args.stopwords)
+    db = WbData("users.sqlite",  path + ".db")
+    if args.no_store:
+        counts = count_words(db, workers=args.workers, stopwords=stopwords, skip_dups=args.skip_duplicates)
+        generate(counts, path + '.png')
+        exporter = exporters['.xlsx'](path + '.xlsx', report_labels, report_sheet)
+        exporter.write(counts.most_common())
+        exporter.close()
+    else:
+        store = TokenStore(db)
+        print("[+] tokenized %d new rows" % store.update(workers=args.workers, stopwords=stopwords))
+        counts = store.frequencies(args.start, args.end, args.mid, args.skip_duplicates)
+        generate(counts, path + '.png')
+        export(db, 'words', path + '.xlsx', labels=report_labels, sheet_name=report_sheet,
+               start=args.start, end=args.end, mids=args.mid, skip_dups=args.skip_duplicates)
+    db.close()